@@ -1,4 +1,4 @@
-import requests
+import lib.tools.httpClient as hc
 from pathlib import Path
 import lib.commonFuncs as cmn
 import yaml
@@ -12,7 +12,7 @@ def build(outputFilePath: Path, savedFilePath: Path) -> None:
     baseDLUrl = "https://42basepairs.com/download/s3/genomeark/species/"
 
     if not savedFilePath.exists():
-        rawHTML = requests.get(location)
+        rawHTML = hc.get(location)
         rawJSON = rawHTML.json()
         speciesList = rawJSON.get("files", [])
 
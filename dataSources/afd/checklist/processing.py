@@ -1,16 +1,22 @@
 import requests
+import lib.tools.httpClient as hc
 import json
 from pathlib import Path
 import pandas as pd
 from io import BytesIO
 from lib.tools.bigFileWriter import BigFileWriter, Format
-from bs4 import BeautifulSoup
+from lxml import html
 from lib.tools.progressBar import SteppableProgressBar
+from lib.tools.checkpoint import Checkpoint
+from lib.tools.logger import Logger
+from collections import deque
+import concurrent.futures
 import re
-import traceback
 
 class EntryData:
     def __init__(self, rawData: dict):
+        self.rawData = rawData
+
         data = rawData.get("data", {})
         self.title = data["title"]
 
@@ -26,38 +32,88 @@ class EntryData:
         self.state = rawData.get("state", "")
         self.children = [EntryData(child) for child in rawData.get("children", [])]
 
-def retrieve(outputFilePath: Path):
+def retrieve(outputFilePath: Path, workers: int = 8):
     writer = BigFileWriter(outputFilePath, "sections", "section")
 
     checklist = "https://biodiversity.org.au/afd/mainchecklist"
-    response = requests.get(checklist).text
+    response = hc.get(checklist).text
 
     start = response.find("[", response.find("var data ="))
     end = response.rfind("]", start, response.rfind("var checklist;")) + 1
 
     kingdomData = [EntryData(kingdom) for kingdom in json.loads(response[start:end])]
-    downloadChildCSVs(kingdomData, writer, [])
-
-    writer.oneFile(False)
-
-def downloadChildCSVs(entryData: list[EntryData], writer: BigFileWriter, parentRanks: list[str]) -> None:
-    for entry in entryData:
-        content = getCSVData(entry.key)
-        higherTaxonomy = parentRanks + [entry.rank]
-        if content is not None:
-            df = buildDF(content)
-            # df["higher_taxonomy"] = ";".join(higherTaxonomy)
-            writer.writeDF(df)
-            print(f"Wrote file #{len(writer.writtenFiles)}", end="\r")
-            continue
 
-        # Content was too large to download
-        children = entry.children if entry.children else findChildren(entry.key)
-        downloadChildCSVs(children, writer, higherTaxonomy)
+    checkpoint = Checkpoint(outputFilePath.parent / "checklistProgress.sqlite")
+    if not downloadChildCSVs(kingdomData, writer, checkpoint, workers):
+        Logger.warning("Some taxa failed to download, run again to retry them")
+        return
+
+    # Sections finish in any order, sorting by tree position keeps the combined checklist in depth first order
+    order = {value["file"]: value["order"] for _, value in checkpoint.iterDone() if "file" in value}
+    writer.writtenFiles.sort(key=lambda subfile: order.get(subfile.fileName, []))
+
+    writer.oneFile()
+    checkpoint.clear()
+
+def downloadChildCSVs(entryData: list[EntryData], writer: BigFileWriter, checkpoint: Checkpoint, workers: int) -> bool:
+    completed = {key: value for key, value in checkpoint.iterDone()}
+
+    # Only keep sections recorded as complete, a section written before its node was checkpointed is fetched again
+    writer.populateFromFolder(writer.subfileDir)
+    writtenFiles = {value["file"] for value in completed.values() if "file" in value}
+    for subfile in [subfile for subfile in writer.writtenFiles if subfile.fileName not in writtenFiles]:
+        subfile.remove()
+        writer.writtenFiles.remove(subfile)
+
+    pending = deque((entry, [idx]) for idx, entry in enumerate(entryData)) # Entries carry their position in the tree
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures: dict[concurrent.futures.Future, tuple[EntryData, list[int]]] = {}
+
+        while pending or futures:
+            while pending and len(futures) < workers * 2: # Bounded number of requests in flight
+                entry, order = pending.popleft()
+
+                if entry.key in completed: # Resume from checkpointed node
+                    pending.extend((EntryData(child), order + [idx]) for idx, child in enumerate(completed[entry.key].get("children", [])))
+                    continue
+
+                futures[executor.submit(getNodeData, entry)] = (entry, order)
+
+            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                entry, order = futures.pop(future)
+
+                try:
+                    df, children = future.result()
+                except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+                    Logger.warning(f"Failed to retrieve taxon {entry.key}: {e}")
+                    checkpoint.markFailed([entry.key])
+                    failed += 1
+                    continue
+
+                if df is not None:
+                    writer.writeDF(df, entry.key, checkName=False) # Taxon keys are unique
+                    checkpoint.markDone({entry.key: {"file": writer.writtenFiles[-1].fileName, "order": order}})
+                else: # Content was too large to download
+                    checkpoint.markDone({entry.key: {"children": [child.rawData for child in children]}})
+                    pending.extend((child, order + [idx]) for idx, child in enumerate(children))
+
+                print(f"Wrote file #{len(writer.writtenFiles)} | Queued taxa: {len(pending) + len(futures)}", end="\r")
+
+    print()
+    return failed == 0
+
+def getNodeData(entry: EntryData) -> tuple[pd.DataFrame | None, list[EntryData]]:
+    content = getCSVData(entry.key)
+    if content is not None:
+        return buildDF(content), []
+
+    return None, entry.children if entry.children else findChildren(entry.key)
 
 def getCSVData(taxonKey: str) -> str | None:
     url = f"https://biodiversity.org.au/afd/taxa/{taxonKey}/names/csv/{taxonKey}.csv"
-    response = requests.get(url)
+    response = hc.get(url)
     if not response.headers["Content-Type"].startswith("application/csv"):
         return None
     
@@ -67,7 +123,7 @@ def buildDF(content: bytes) -> pd.DataFrame:
     return pd.read_csv(BytesIO(content), encoding="iso-8859-1")
 
 def findChildren(taxonKey: str) -> list[EntryData]:
-    response = requests.get(f"https://biodiversity.org.au/afd/taxa/{taxonKey}/checklist-subtaxa.json")
+    response = hc.get(f"https://biodiversity.org.au/afd/taxa/{taxonKey}/checklist-subtaxa.json")
     try:
         children = response.json()
     except requests.exceptions.JSONDecodeError:
@@ -179,68 +235,129 @@ def addParents(filePath: Path, outputFilePath: Path) -> None:
 
     df.to_csv(outputFilePath, index=False)
 
-def enrich(filePath: Path, outputFilePath: Path) -> None:
+def enrich(filePath: Path, outputFilePath: Path, workers: int = 16, parsers: int = None, batchSize: int = 500) -> None:
     df = pd.read_csv(filePath, dtype=object)
-    session = requests.Session()
+    session = hc.CachedSession("afd")
 
     for rank in ("Species", "Genus"):
-        subDF = df[df["taxon_rank"] == rank]
-
         enrichmentPath = outputFilePath.parent / f"{rank}.csv"
-        if enrichmentPath.exists():
-            continue
-
-        writer = BigFileWriter(enrichmentPath, rank, subfileType=Format.CSV)
-        writer.populateFromFolder(writer.subfileDir)
-        subfileNames = [file.fileName for file in writer.writtenFiles]
-
-        uniqueSeries = subDF["taxon_id"].unique()
-        uniqueSeries = [item for item in uniqueSeries if item not in subfileNames]
-        
-        bar = SteppableProgressBar(len(uniqueSeries), processName=f"{rank} Progress")
-        for taxonID in uniqueSeries:
-            bar.update()
-
-            response = session.get(f"https://biodiversity.org.au/afd/taxa/{taxonID}/complete")
-            try:
-                records = _parseContent(response.text, taxonID, rank.lower())
-            except:
-                print(taxonID)
-                print(traceback.format_exc())
+        if not enrichmentPath.exists():
+            taxonIDs = df[df["taxon_rank"] == rank]["taxon_id"].dropna().unique().tolist()
+            if not _enrichRank(taxonIDs, rank, enrichmentPath, session, workers, parsers, batchSize):
+                Logger.warning(f"Some {rank.lower()} pages failed to retrieve or parse, run again to retry them")
                 return
-            
-            recordDF = pd.DataFrame.from_records(records)
-            writer.writeDF(recordDF, taxonID)
 
-        writer.oneFile(False)
         enrichmentDF = pd.read_csv(enrichmentPath, dtype=object)
         df = df.merge(enrichmentDF, "left", ["taxon_id", rank.lower()])
 
     df.to_csv(outputFilePath)
 
+def _enrichRank(taxonIDs: list[str], rank: str, enrichmentPath: Path, session: requests.Session, workers: int, parsers: int, batchSize: int) -> bool:
+    writer = BigFileWriter(enrichmentPath, rank, subfileType=Format.CSV)
+    checkpoint = Checkpoint(enrichmentPath.parent / f"{rank}Progress.sqlite")
+
+    # Only keep batches recorded as complete, taxa from a batch written before being checkpointed are fetched again
+    writer.populateFromFolder(writer.subfileDir)
+    writtenFiles = {value["file"] for _, value in checkpoint.iterDone()}
+    for subfile in [subfile for subfile in writer.writtenFiles if subfile.fileName not in writtenFiles]:
+        subfile.remove()
+        writer.writtenFiles.remove(subfile)
+
+    pending = deque(checkpoint.getPending(taxonIDs))
+    records = []
+    batchIDs = []
+    failed = 0
+
+    def writeBatch() -> None:
+        if records:
+            writer.writeDF(pd.DataFrame.from_records(records))
+
+        fileName = writer.writtenFiles[-1].fileName if records else ""
+        checkpoint.markDone({taxonID: {"file": fileName} for taxonID in batchIDs})
+        records.clear()
+        batchIDs.clear()
+
+    bar = SteppableProgressBar(max(len(pending), 1), processName=f"{rank} Progress")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=parsers) as parsePool, concurrent.futures.ThreadPoolExecutor(max_workers=workers) as fetchPool:
+        fetches: dict[concurrent.futures.Future, str] = {}
+        parses: dict[concurrent.futures.Future, str] = {}
+
+        while pending or fetches or parses:
+            while pending and len(fetches) + len(parses) < workers * 2: # Bounded number of pages held in memory
+                taxonID = pending.popleft()
+                fetches[fetchPool.submit(_getPage, session, taxonID)] = taxonID
+
+            done, _ = concurrent.futures.wait(list(fetches) + list(parses), return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future in fetches: # Page retrieved, hand off to parser processes
+                    taxonID = fetches.pop(future)
+                    try:
+                        parses[parsePool.submit(_parseContent, future.result(), taxonID, rank.lower())] = taxonID
+                    except requests.exceptions.RequestException as e:
+                        Logger.warning(f"Failed to retrieve {taxonID}: {e}")
+                        checkpoint.markFailed([taxonID])
+                        failed += 1
+                        bar.update()
+
+                    continue
+
+                taxonID = parses.pop(future)
+                bar.update()
+                try:
+                    records.extend(future.result())
+                    batchIDs.append(taxonID)
+                except Exception as e:
+                    Logger.warning(f"Failed to parse {taxonID}: {e!r}")
+                    checkpoint.markFailed([taxonID])
+                    failed += 1
+
+            if len(batchIDs) >= batchSize:
+                writeBatch()
+
+    writeBatch()
+
+    if failed:
+        return False
+
+    writer.oneFile()
+    checkpoint.clear()
+    return True
+
+def _getPage(session: requests.Session, taxonID: str) -> str:
+    response = session.get(f"https://biodiversity.org.au/afd/taxa/{taxonID}/complete")
+    response.raise_for_status()
+    return response.text
+
+def _getText(element: html.HtmlElement) -> str:
+    return "".join(element.itertext())
+
+def _findNext(element: html.HtmlElement, tag: str) -> html.HtmlElement | None:
+    matches = element.xpath(f"(descendant::{tag} | following::{tag})[1]") # Next tag in document order
+    return matches[0] if matches else None
+
 def _parseContent(content: str, taxonID: str, rank: str) -> list[dict]:
-    soup = BeautifulSoup(content, "html.parser")
+    tree = html.fromstring(content)
 
-    distribution = soup.find("div", {"id": "afdDistribution"})
+    distribution = _findByID(tree, "afdDistribution")
     distributionData = {}
     if distribution is not None:
-        for heading in distribution.find_all("h4"):
-            key = heading.text.lower().replace(" ", "_")
+        for heading in distribution.iter("h4"):
+            key = _getText(heading).lower().replace(" ", "_")
 
             if key in ("australian_region", "afrotropical_region"):
                 regionData = {}
-                countries = heading.find_next("ul")
+                countries = _findNext(heading, "ul")
                 if countries is None:
                     continue
                 
-                for countryDotPoints in countries.findChildren("li"):
-                    countryName = countryDotPoints.find_next("strong").text
+                for countryDotPoints in countries.iter("li"):
+                    countryName = _getText(_findNext(countryDotPoints, "strong"))
                     stateData = {}
 
-                    stateDotPoints = countryDotPoints.findChild("ul")
+                    stateDotPoints = countryDotPoints.find(".//ul")
                     if stateDotPoints is not None:
-                        for item in stateDotPoints.find_all("li"):
-                            itemData = item.text.replace("\n", " ").split(":")
+                        for item in stateDotPoints.iter("li"):
+                            itemData = _getText(item).replace("\n", " ").split(":")
                             if len(itemData) == 1:
                                 stateData[itemData[0].strip()] = ""
                             else:
@@ -252,40 +369,47 @@ def _parseContent(content: str, taxonID: str, rank: str) -> list[dict]:
                 distributionData[key] = regionData
 
             else:
-                value = heading.find_next("p")
+                value = _findNext(heading, "p")
                 if value is None:
                     continue
 
-                text = value.text.replace("\t", " ").replace("\n", " ").strip()
+                text = _getText(value).replace("\t", " ").replace("\n", " ").strip()
                 text = re.sub(" +", " ", text)
                 distributionData[key] = text
 
-    descriptors = soup.find("div", {"id": "afdEcologicalDescriptors"})
+    descriptors = _findByID(tree, "afdEcologicalDescriptors")
     descriptorList = []
     if descriptors is not None:
-        for desc in descriptors.find_all("p"):
-            text = desc.text.replace("\t", " ").strip()
+        for desc in descriptors.iter("p"):
+            text = _getText(desc).replace("\t", " ").strip()
             if text:
                 descriptorList.append(text)
     descriptorData = {"descriptors": "|".join(descriptorList)}
 
     records = []
-    synonyms = soup.find("div", {"id": "afdSynonyms"})
+    synonyms = _findByID(tree, "afdSynonyms")
     if synonyms is None:
         return [{"taxon_id": taxonID} | distributionData | descriptorData]
 
-    for synonmn in synonyms.find_all("li"):
-        synonymTitle = synonmn.find_next("div")
-        synonymData = synonymTitle.find_next("div")
+    for synonmn in synonyms.iter("li"):
+        synonymTitle = _findNext(synonmn, "div")
+        synonymData = _findNext(synonymTitle, "div")
 
-        if synonymData.parent != synonymTitle.parent: # No type data if next div is at a lower level
+        if synonymData.getparent() is not synonymTitle.getparent(): # No type data if next div is at a lower level
             continue
 
         data = {}
-        for typeData in synonymData.find_all("div"):
-            data[typeData.find("h5").text.lower().replace(" ", "_")[:-1]] = synonymData.find("span").text
+        for typeData in synonymData.iter("div"):
+            if typeData is synonymData:
+                continue
 
-        record = {"taxon_id": taxonID, rank: synonymTitle.find("strong").text.split()[-1]} | data
+            data[_getText(typeData.find(".//h5")).lower().replace(" ", "_")[:-1]] = _getText(synonymData.find(".//span"))
+
+        record = {"taxon_id": taxonID, rank: _getText(synonymTitle.find(".//strong")).split()[-1]} | data
         records.append(record | distributionData | descriptorData)
 
     return records
+
+def _findByID(tree: html.HtmlElement, elementID: str) -> html.HtmlElement | None:
+    matches = tree.xpath(f"//div[@id='{elementID}']")
+    return matches[0] if matches else None
@@ -1,5 +1,5 @@
 import pandas as pd
-import requests
+import lib.tools.httpClient as hc
 import json
 import math
 from pathlib import Path
@@ -10,7 +10,7 @@ def build(outputFilePath: Path) -> None:
     firstCall = baseURL + "&pageSize=0"
     readSize = 1000
 
-    rawData = requests.get(firstCall)
+    rawData = hc.get(firstCall)
     jsData = rawData.json()
 
     records = jsData["totalRecords"]
@@ -20,7 +20,7 @@ def build(outputFilePath: Path) -> None:
     for call in range(totalCalls):
         callURL = baseURL + f"&pageSize={readSize}" + f"&startIndex={call*readSize}"
         print(f"At call: {call+1} / {totalCalls}", end="\r")
-        rawData = requests.get(callURL)
+        rawData = hc.get(callURL)
         jsData = rawData.json()
         occurrences.extend(jsData["occurrences"])
 
@@ -34,7 +34,7 @@ def collect(outputDir: Path, profile: str, tokenFilePath: Path) -> None:
     bearerToken = token["access_token"]
     baseURL = "https://api.ala.org.au/profiles"
     endpoint = f"/api/opus/{profile}/profile?pageSize=1000"
-    response = requests.get(baseURL + endpoint, headers={"Authorization": f"Bearer {bearerToken}"})
+    response = hc.get(baseURL + endpoint, headers={"Authorization": f"Bearer {bearerToken}"})
     data = response.json()
 
     if "message" in data and "not authorized" in data["message"]:
@@ -48,7 +48,7 @@ def collect(outputDir: Path, profile: str, tokenFilePath: Path) -> None:
         uuid = entry["uuid"]
         print(f"At record: {idx}", end="\r")
 
-        response = requests.get(baseURL + f"/api/opus/{profile}/profile/{uuid}", headers={"Authorization": f"Bearer {bearerToken}"})
+        response = hc.get(baseURL + f"/api/opus/{profile}/profile/{uuid}", headers={"Authorization": f"Bearer {bearerToken}"})
         records.append(response.json())
     print()
 
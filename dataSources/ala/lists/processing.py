@@ -1,10 +1,10 @@
 from pathlib import Path
 import pandas as pd
-import requests
+import lib.tools.httpClient as hc
 
 def collect(outputPath: Path) -> None:
     baseURL = "https://lists-ws.test.ala.org.au/"
-    session = requests.Session()
+    session = hc.CachedSession("ala")
     recordsPerPage = 100
     
     def getURL(endpoint: str, params: dict, pageSize: int, page: int = 1) -> dict:
@@ -1,4 +1,4 @@
-import requests
+import lib.tools.httpClient as hc
 from pathlib import Path
 import pandas as pd
 import json
@@ -19,7 +19,7 @@ def build(outputFile: Path, apiKeyPath: Path) -> None:
     }
 
     entriesPerCall = 1000
-    response = requests.get(getUrl(entriesPerCall, 0), headers=headers)
+    response = hc.get(getUrl(entriesPerCall, 0), headers=headers)
     data = response.json()
     
     records = data["result"]
@@ -27,7 +27,7 @@ def build(outputFile: Path, apiKeyPath: Path) -> None:
 
     for call in range(1, totalCalls):
         print(f"At call: {call} / {totalCalls - 1}", end="\r")
-        response = requests.get(getUrl(entriesPerCall, call), headers=headers)
+        response = hc.get(getUrl(entriesPerCall, call), headers=headers)
 
         try:
             data = response.json()
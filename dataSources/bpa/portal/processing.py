@@ -1,12 +1,12 @@
 from pathlib import Path
-import requests
+import lib.tools.httpClient as hc
 import pandas as pd
 import math
 
 def build(outputFilePath: Path, entriesPerPage: int) -> None:
     url = "https://data.bioplatforms.com/api/3/action/package_search?q=*:*&rows="
 
-    initialRequest = requests.get(f"{url}{0}")
+    initialRequest = hc.get(f"{url}{0}")
     initialJson = initialRequest.json()
 
     summary = initialJson.get("result", {})
@@ -22,7 +22,7 @@ def build(outputFilePath: Path, entriesPerPage: int) -> None:
     for call in range(numberOfCalls):
         startEntry = call * entriesPerPage
         print(f"Reading page: {call+1} / {numberOfCalls}", end='\r')
-        response = requests.get(f"{url}{entriesPerPage}&start={startEntry}")
+        response = hc.get(f"{url}{entriesPerPage}&start={startEntry}")
         responseData = response.json()
 
         summary = responseData.get("result", {})
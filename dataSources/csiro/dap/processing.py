@@ -1,5 +1,5 @@
 import math
-import requests
+import lib.tools.httpClient as hc
 import pandas as pd
 
 def getPortalData(outputFilePath: Path) -> None:
@@ -7,7 +7,7 @@ def getPortalData(outputFilePath: Path) -> None:
     entriesPerPage = 100
 
     # Get page 1 first, then iterate over remaining pages
-    response = requests.get(f"{baseURL}?rpp={entriesPerPage}&p={1}")
+    response = hc.get(f"{baseURL}?rpp={entriesPerPage}&p={1}")
     data = response.json()
     records = data["dataCollections"]
 
@@ -15,7 +15,7 @@ def getPortalData(outputFilePath: Path) -> None:
     totalCalls = math.ceil(int(totalResults) / entriesPerPage)
 
     for call in range(1, totalCalls):
-        response = requests.get(f"{baseURL}?rpp={entriesPerPage}&p={call+1}")
+        response = hc.get(f"{baseURL}?rpp={entriesPerPage}&p={call+1}")
         data = response.json()
         records.extend(data["dataCollections"])
 
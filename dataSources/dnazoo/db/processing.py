@@ -1,11 +1,12 @@
 import requests
+import lib.tools.httpClient as hc
 from bs4 import BeautifulSoup
 import pandas as pd
 from pathlib import Path
 
 def build(outputFilePath: Path) -> None:
     retrieveURL = "https://dnazoo.s3.wasabisys.com/?delimiter=/"
-    rawHTML = requests.get(retrieveURL)
+    rawHTML = hc.get(retrieveURL)
     soup = BeautifulSoup(rawHTML.text, "xml")
     
     baseDLURL = "https://dnazoo.s3.wasabisys.com/"
@@ -19,7 +20,7 @@ def build(outputFilePath: Path) -> None:
         print(f"At species #{idx}: {species.text[:-1]}", end="\r")
 
         dataURL = baseDLURL + species.text + "README.json"
-        rawData = requests.get(dataURL)
+        rawData = hc.get(dataURL)
         if rawData.status_code != requests.codes.ok:
             continue # No JSON for this species
 
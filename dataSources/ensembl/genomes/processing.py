@@ -1,32 +1,27 @@
 import json
 import pandas as pd
-import requests
+import lib.tools.httpClient as hc
 from pathlib import Path
-from lib.tools.downloader import Downloader
-import lib.tools.zipping as zp
+import lib.tools.downloading as dl
+from lib.tools.logger import Logger
+import concurrent.futures
+import requests
 from bs4 import BeautifulSoup
 
-def download(url: str, outputDir: Path, overwrite: bool = False) -> Path:
+def download(url: str, outputDir: Path, overwrite: bool = False, session: requests.Session = None) -> Path:
     localFile = Path(outputDir / f"{'_'.join(url.rsplit('/', 2)[-2:])}")
 
     if not localFile.exists() or overwrite:
-        localFile.unlink(True)
-
-        dl = Downloader()
-        success = dl.download(url, localFile, verbose=True)
+        success = dl.download(url, localFile, session=session)
 
         if not success:
             return None
 
-    if zp.canBeExtracted(localFile):
-        if not zp.extractsTo(localFile, outputDir).exists() or overwrite:
-            return zp.extract(localFile, overwrite=overwrite)
-    
     return localFile
 
 def speciesDownload(outputFilePath: Path) -> None:
     url = "https://rest.ensembl.org/info/species?"
-    request = requests.get(url, headers={ "Content-Type" : "application/json"})
+    request = hc.get(url, headers={ "Content-Type" : "application/json"})
  
     if not request.ok:
         request.raise_for_status()
@@ -54,42 +49,64 @@ def flatten(filePath: Path, outputFilePath: Path) -> None:
 
     pd.DataFrame.from_records(records).to_csv(outputFilePath, index=False)
 
-def enrich(filePath: Path, subsection: str, outputFilePath: Path) -> None:
+def enrich(filePath: Path, subsection: str, outputFilePath: Path, workers: int = 8) -> None:
     df = pd.read_csv(filePath, sep="\t", dtype=object, index_col=False)
 
     baseURL = f"http://ftp.ensemblgenomes.org/pub/{subsection}/current/mysql/"
     outputFolder = Path(outputFilePath.parent / "enrichFiles")
     outputFolder.mkdir(exist_ok=True)
 
-    records = []
-    for _, row in df.iterrows():
-        db = row["core_db"]
-        id = row["species_id"]
-
-        tempBase = baseURL + db + "/"
-        metaURL = tempBase + "meta.txt.gz"
-        statsURL = tempBase + "genome_statistics.txt.gz"
-
-        meta = download(metaURL, outputFolder)
-        metaDF = pd.read_csv(meta, header=None, sep="\t", index_col=0, names=["id", "column", "value"], dtype=object)
-        
-        relevant = metaDF[metaDF["id"] == id]
-        relevantData = dict(zip(relevant.column, relevant.value))
-        record = {"name": row["#name"]} | {key.replace(".", "_"): value for key, value in relevantData.items()}
-
-        stats = download(statsURL, outputFolder)
-        statsDF = pd.read_csv(stats, header=None, sep="\t", index_col=0, names=["column", "value", "id", "n", "timestamp"], dtype=object)
-        relevant = statsDF[statsDF["id"] == id]
-        relevantData = dict(zip(relevant.column, relevant.value))
-        record |= relevantData
-
-        records.append(record)
-
-    enrichDF = pd.DataFrame.from_records(records)
+    # Collection databases hold many species, so each database is downloaded and parsed once
+    session = dl.buildSession(workers)
+    metaTables = []
+    statsTables = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_loadDatabase, baseURL + db + "/", outputFolder, session): db for db in df["core_db"].dropna().unique()}
+        for future in concurrent.futures.as_completed(futures):
+            db = futures[future]
+            tables = future.result()
+            if tables is None:
+                Logger.warning(f"Unable to retrieve tables for database {db}")
+                continue
+
+            metaDF, statsDF = tables
+            metaTables.append(metaDF.assign(core_db=db))
+            statsTables.append(statsDF.assign(core_db=db))
+
+    rows = df[["core_db", "species_id"]].reset_index(names="row")
+    metaDF = _pivotTable(rows, pd.concat(metaTables, ignore_index=True) if metaTables else None)
+    metaDF.columns = [column.replace(".", "_") for column in metaDF.columns]
+    statsDF = _pivotTable(rows, pd.concat(statsTables, ignore_index=True) if statsTables else None)
+
+    enrichDF = metaDF.drop(columns=metaDF.columns.intersection(statsDF.columns)).join(statsDF, how="outer") # Statistics take priority over meta values
+    enrichDF["name"] = df["#name"]
+
     uniqueCols = enrichDF.columns.difference(df.columns)
-    df = df.merge(enrichDF[uniqueCols], how="outer", left_on="#name", right_on="name")
+    df = df.join(enrichDF[uniqueCols])
     df.to_csv(outputFilePath, index=False)
 
+def _loadDatabase(dbURL: str, outputFolder: Path, session: requests.Session) -> tuple[pd.DataFrame, pd.DataFrame] | None:
+    meta = download(dbURL + "meta.txt.gz", outputFolder, session=session)
+    stats = download(dbURL + "genome_statistics.txt.gz", outputFolder, session=session)
+    if meta is None or stats is None:
+        return None
+
+    # meta columns: meta_id, species_id, meta_key, meta_value
+    metaDF = pd.read_csv(meta, header=None, sep="\t", usecols=[1, 2, 3], names=["meta_id", "species_id", "column", "value"], dtype=object)
+
+    # genome_statistics columns: genome_statistics_id, statistic, value, species_id, attrib_type_id, timestamp
+    statsDF = pd.read_csv(stats, header=None, sep="\t", usecols=[1, 2, 3], names=["stats_id", "column", "value", "species_id", "n", "timestamp"], dtype=object)
+
+    return metaDF, statsDF
+
+def _pivotTable(rows: pd.DataFrame, table: pd.DataFrame | None) -> pd.DataFrame:
+    if table is None:
+        return pd.DataFrame(index=rows["row"])
+
+    table = rows.merge(table, "inner", on=["core_db", "species_id"])
+    table = table.drop_duplicates(["row", "column"], keep="last") # Later values replace earlier ones for repeated keys
+    return table.pivot(index="row", columns="column", values="value").rename_axis(index=None, columns=None)
+
 def combine(metadataPath: Path, statsPath: Path, outputFilePath: Path) -> None:
     metadata = pd.read_csv(metadataPath)
     stats = pd.read_csv(statsPath)
@@ -103,7 +120,7 @@ def collectVGP(outputFilePath: Path):
     
     url = "https://projects.ensembl.org/vgp/"
 
-    pageData = requests.get(url)
+    pageData = hc.get(url)
     soup = BeautifulSoup(pageData.text, "html.parser")
 
     table = soup.find("table")
@@ -137,7 +154,7 @@ def collectVGP(outputFilePath: Path):
     pd.DataFrame.from_records(rowData).to_csv(outputFilePath, index=False)
 
 def collectStats(url: str) -> dict:
-    pageData = requests.get(url)
+    pageData = hc.get(url)
     soup = BeautifulSoup(pageData.text, "html.parser")
 
     data = {}
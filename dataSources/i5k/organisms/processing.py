@@ -1,4 +1,4 @@
-import requests
+import lib.tools.httpClient as hc
 import pandas as pd
 import concurrent.futures
 from pathlib import Path
@@ -6,7 +6,7 @@ from bs4 import BeautifulSoup, ResultSet
 
 def _getSoup(suffix: str) -> BeautifulSoup:
     baseURL = "https://i5k.nal.usda.gov"
-    response = requests.get(baseURL + suffix)
+    response = hc.get(baseURL + suffix)
     return BeautifulSoup(response.text, "html.parser")
 
 def _parseAnalysisRow(tableRow: ResultSet[any]) -> dict:
@@ -1,11 +1,17 @@
 import requests
+import lib.tools.httpClient as hc
 from pathlib import Path
 import pandas as pd
 from lib.tools.bigFileWriter import BigFileWriter
+from lib.tools.checkpoint import Checkpoint
+from lib.tools.rateLimiter import TokenBucket
+from lib.tools.logger import Logger
+import concurrent.futures
 import time
 import lib.dataframeFuncs as dff
+import lib.commonFuncs as cmn
 
-def retrieve(apiKeyPath: Path, outputFilePath: Path):
+def retrieve(apiKeyPath: Path, outputFilePath: Path, workers: int = 8, requestsPerSecond: float = 4, chunkSize: int = 10000):
     with open(apiKeyPath) as fp:
         apiKey = fp.read().rstrip(" \n")
 
@@ -15,77 +21,155 @@ def retrieve(apiKeyPath: Path, outputFilePath: Path):
         "Authorization": apiKey
     }
 
-    session = requests.Session()
+    session = hc.CachedSession("iucn", shouldCache=lambda response: response.ok and not response.text.startswith("Retry later"))
+    limiter = TokenBucket(requestsPerSecond)
 
     # Get version
-    response = session.get(f"{baseURL}/information/red_list_version", headers=headers)
-    version = list(response.json().values())[0]
+    data = _request(session, f"{baseURL}/information/red_list_version", headers, limiter)
+    if data is None:
+        Logger.error("Unable to retrieve red list version")
+        return
+
+    version = list(data.values())[0]
     print(f"Version: {version}")
-    
+
+    # Completed assessments are checkpointed per red list version so restarts resume mid page
+    checkpoint = Checkpoint(outputFilePath.parent / f"assessments_{''.join(char if char.isalnum() else '_' for char in str(version))}.sqlite")
+
+    assessmentIDs = []
+    completed = 0
+    failed = 0
+    finished = {}
+    pageFailed = False
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures: dict[concurrent.futures.Future, str] = {}
+
+        def collect(wait: bool) -> None:
+            nonlocal completed, failed
+
+            done, _ = concurrent.futures.wait(futures, timeout=None if wait else 0)
+            for future in done:
+                assessmentID = futures.pop(future)
+                record = future.result()
+                if record is None:
+                    checkpoint.markFailed([assessmentID])
+                    failed += 1
+                else:
+                    finished[assessmentID] = record
+
+                completed += 1
+
+            if len(finished) >= 50 or (wait and finished): # Save completed assessments in groups
+                checkpoint.markDone(finished)
+                finished.clear()
+
+            print(f"Retrieved assessments: {completed} | Failed: {failed} | Queued: {len(futures)}", end="\r")
+
+        onPage = 1
+        while True:
+            data = _request(session, f"{baseURL}/scopes/1?page={onPage}&latest=true", headers, limiter)
+            if data is None:
+                pageFailed = True
+                break
+
+            pageIDs = [str(assessment["assessment_id"]) for assessment in data["assessments"]]
+            assessmentIDs.extend(pageIDs)
+
+            for assessmentID in checkpoint.getPending(pageIDs):
+                futures[executor.submit(_retrieveAssessment, session, baseURL, assessmentID, headers, limiter)] = assessmentID
+
+            while len(futures) > workers * 10: # Stop reading pages too far ahead of assessment requests
+                collect(True)
+
+            collect(False)
+            if len(pageIDs) < 100:
+                break
+
+            onPage += 1
+
+        while futures:
+            collect(True)
+
+    print()
+    if pageFailed: # Partial output would pass as complete, leave the checkpoint for the next run to resume from
+        Logger.error(f"Failed to retrieve page {onPage} of assessments, progress has been checkpointed")
+        return
+
+    if failed: # Output would be missing these assessments and pass as complete, so only write once all have been retrieved
+        Logger.error(f"Failed to retrieve {failed} assessments, progress has been checkpointed and these will be retried on next run")
+        return
+
     writer = BigFileWriter(outputFilePath)
-    writer.populateFromFolder(writer.subfileDir)
-    onPage = len(writer.writtenFiles) + 1
-
-    running = True
-    while running:
-        for _ in range(6):
-            response = session.get(f"{baseURL}/scopes/1?page={onPage}&latest=true", headers=headers)
-            if response.text.startswith("Retry later"):
-                time.sleep(5)
-                continue
-
-            data: dict = response.json()
-            assessmentIDs = [assessment["assessment_id"] for assessment in data["assessments"]]
-            break
-        else:
-            print("Failed\n\n")
-            return
-
-        if len(assessmentIDs) < 100 or not assessmentIDs:
-            running = False
-
-        records = []
-
-        for idx, assessmentID in enumerate(assessmentIDs, start=1):
-            print(f"Processing assessment ID #{((onPage - 1) * 100) + idx}: {assessmentID}", end= "\r")
-            response = session.get(f"{baseURL}/assessment/{assessmentID}", headers=headers)
-            try:
-                data: dict = response.json()
-            except requests.exceptions.JSONDecodeError:
-                continue
-
-            taxonomy = data.pop("taxon")
-
-            commonNames = taxonomy.pop("common_names")
-            taxonomy["common_names"] = []
-            for name in commonNames:
-                if isinstance(name["language"], dict):
-                    name["language"] = name["language"]["description"]["en"]
-                taxonomy["common_names"].append(name)
-
-            # Flatten description from following items
-            for item in ("population_trend", "red_list_category", "biogeographical_realms", "systems"):
-                if isinstance(data[item], dict):
-                    data[item] = data[item]["description"]["en"]
-
-                if isinstance(data[item], list):
-                    data[item] = [element["description"]["en"] for element in data[item]]
-
-            supplementaryInfo = data.pop("supplementary_info")
-
-            # Remove scopes
-            data.pop("scopes")
-
-            records.append(data | taxonomy | supplementaryInfo)
-
-        df = pd.DataFrame.from_records(records)
+    cmn.clearFolder(writer.subfileDir) # Checkpoint holds all records, chunks from earlier runs are stale
+    for start in range(0, len(assessmentIDs), chunkSize):
+        section = assessmentIDs[start:start + chunkSize]
+        records = checkpoint.getMany(section)
+        if not records:
+            continue
+
+        df = pd.DataFrame.from_records([records[assessmentID] for assessmentID in section if assessmentID in records])
         df = dff.removeSpaces(df)
-        
         writer.writeDF(df)
-        onPage += 1
 
-    writer.oneFile(False)
-    print()
+    writer.oneFile()
+
+def _request(session: requests.Session, url: str, headers: dict, limiter: TokenBucket, retries: int = 6) -> dict | None:
+    for attempt in range(retries):
+        limiter.acquire()
+
+        try:
+            response = session.get(url, headers=headers)
+        except requests.exceptions.RequestException:
+            time.sleep(2 ** attempt)
+            continue
+
+        if response.text.startswith("Retry later"): # Server is rate limiting, slow every worker down
+            limiter.penalise(2 ** attempt)
+            time.sleep(2 ** attempt)
+            continue
+
+        try:
+            return response.json()
+        except requests.exceptions.JSONDecodeError:
+            return None
+
+    return None
+
+def _retrieveAssessment(session: requests.Session, baseURL: str, assessmentID: str, headers: dict, limiter: TokenBucket) -> dict | None:
+    data = _request(session, f"{baseURL}/assessment/{assessmentID}", headers, limiter)
+    if data is None:
+        return None
+
+    try:
+        return parseAssessment(data)
+    except (KeyError, TypeError) as e:
+        Logger.warning(f"Unexpected format for assessment {assessmentID}: {e}")
+        return None
+
+def parseAssessment(data: dict) -> dict:
+    taxonomy = data.pop("taxon")
+
+    commonNames = taxonomy.pop("common_names")
+    taxonomy["common_names"] = []
+    for name in commonNames:
+        if isinstance(name["language"], dict):
+            name["language"] = name["language"]["description"]["en"]
+        taxonomy["common_names"].append(name)
+
+    # Flatten description from following items
+    for item in ("population_trend", "red_list_category", "biogeographical_realms", "systems"):
+        if isinstance(data[item], dict):
+            data[item] = data[item]["description"]["en"]
+
+        if isinstance(data[item], list):
+            data[item] = [element["description"]["en"] for element in data[item]]
+
+    supplementaryInfo = data.pop("supplementary_info")
+
+    # Remove scopes
+    data.pop("scopes")
+
+    return data | taxonomy | supplementaryInfo
 
 def reduce(filePath: Path, outputFilePath: Path) -> None:
     def filter(field: str) -> bool:
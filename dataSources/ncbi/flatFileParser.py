@@ -1,6 +1,14 @@
+import io
+import re
+from functools import lru_cache
 from pathlib import Path
 from enum import Enum
+from typing import IO, Iterator
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import lib.tools.zipping as zp
+from lib.tools.bigFileWriter import BigFileWriter, Subfile, Format
 
 class Section(Enum):
     LOCUS = "LOCUS"
@@ -15,74 +23,228 @@ class Section(Enum):
     FEATURES = "FEATURES"
     ORIGIN = "ORIGIN"
     CONTIG = "CONTIG"
-    
+
+class _RangeReader(io.RawIOBase):
+    def __init__(self, fileObj: IO[bytes], end: int | None):
+        self._fileObj = fileObj
+        self._end = end
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: memoryview) -> int:
+        size = len(buffer)
+        if self._end is not None:
+            size = min(size, self._end - self._fileObj.tell())
+
+        if size <= 0:
+            return 0
+
+        return self._fileObj.readinto(buffer[:size])
+
+    def close(self) -> None:
+        if self.closed:
+            return
+
+        self._fileObj.close()
+        super().close()
+
 _seqBaseURL = "https://ftp.ncbi.nlm.nih.gov/genbank/"
 _genbankBaseURL = "https://www.ncbi.nlm.nih.gov/nuccore/"
 _fastaSuffix = "?report=fasta&format=text"
+_sequenceHeadings = (Section.ORIGIN.value, Section.CONTIG.value)
+
+# Declared types for nested columns in structured output, any other column is a string or list of strings
+_propertiesType = pa.map_(pa.string(), pa.string())
+_referenceType = pa.struct([(key, pa.string()) for key in ("authors", "consrtm", "title", "journal", "pubmed", "medline", "remark")] + [("bases", pa.list_(pa.string()))])
+_nestedTypes = {
+    "authors": pa.list_(pa.string()),
+    "bases": pa.list_(pa.list_(pa.string())),
+    "references": pa.list_(_referenceType),
+    "pubmed": pa.list_(pa.string()),
+    "title": pa.list_(pa.string()),
+    "journal": pa.list_(pa.string()),
+    "remark": pa.list_(pa.string()),
+    "genes": pa.list_(pa.struct([("gene", pa.string()), ("feature", pa.string()), ("properties", _propertiesType)])),
+    "other_properties": pa.list_(pa.struct([("feature", pa.string()), ("properties", _propertiesType)]))
+}
 
 def parseFlatfile(filePath: Path, verbose: bool = False) -> pd.DataFrame:
-    with open(filePath) as fp:
-        try:
-            data = fp.read()
-        except UnicodeDecodeError:
-            print(f"Failed to read file: {filePath}")
-            return []
+    batches = list(iterBatches(filePath, verbose=verbose))
+    if not batches:
+        return pd.DataFrame()
+
+    return pd.concat(batches, ignore_index=True)
+
+def writeFlatfile(filePath: Path, writer: BigFileWriter, batchSize: int = 5000, verbose: bool = False, structured: bool = False) -> int:
+    recordCount = 0
+    for batch in iterBatches(filePath, batchSize, verbose, structured=structured):
+        if structured:
+            writer.writeTable(batch)
+        else:
+            writer.writeDF(batch)
 
-    # Cut off header of file
-    firstLocusPos = data.find("LOCUS")
-    header = data[:firstLocusPos]
-    data = data[firstLocusPos:]
+        recordCount += len(batch)
+
+    return recordCount
+
+def iterBatches(filePath: Path, batchSize: int = 5000, verbose: bool = False, start: int = 0, end: int = None, structured: bool = False) -> Iterator[pd.DataFrame | pa.Table]:
+    buildBatch = _buildTable if structured else pd.DataFrame.from_records
 
     records = []
-    for idx, entry in enumerate(data.split("//\n")[:-1], start=1): # Split into separate loci, exclude empty entry after last
+    for idx, record in enumerate(iterRecords(filePath, start, end, structured), start=1):
         if verbose:
             print(f"Parsing entry: {idx}", end="\r")
 
-        entryData = _parseEntry(entry)
-
-        # Attach seq file path and fasta file
-        entryData["seq_file"] = f"{_seqBaseURL}{filePath.name}.gz"
-        version = entryData.get("version", "")
-        if version:
-            entryData["genbank_url"] = f"{_genbankBaseURL}{version}"
-            entryData["fasta_url"] = f"{_genbankBaseURL}{version}{_fastaSuffix}"
-
-        # Add specimen field
-        specimenOptions = [
-            "specimen_voucher"
-            "isolate"
-            "accession"
-        ]
-
-        for idx, option in enumerate(specimenOptions, start=1):
-            value = entryData.get(option, None)
-            if value is not None:
-                if idx == len(specimenOptions):
-                    value = f"NCBI_{value}_specimen"
-                entryData["specimen"] = value
-                break
-        else: # No specimen set
-            entryData["specimen"] = None
-
-        records.append(entryData)
+        records.append(record)
+        if len(records) >= batchSize:
+            yield buildBatch(records)
+            records.clear()
 
     if verbose:
         print()
 
-    return pd.DataFrame.from_records(records)
+    if records:
+        yield buildBatch(records)
+
+def iterRecords(filePath: Path, start: int = 0, end: int = None, structured: bool = False) -> Iterator[dict]:
+    seqFileName = filePath.name if filePath.suffix == ".gz" else f"{filePath.name}.gz"
+
+    with (zp.openStream(filePath) if start == 0 and end is None else _openRange(filePath, start, end)) as fp:
+        try:
+            for entry in iterEntries(fp):
+                yield _buildRecord(entry, seqFileName, structured)
+        except UnicodeDecodeError:
+            print(f"Failed to read file: {filePath}")
+
+def iterEntries(fp: IO[str]) -> Iterator[str]:
+    lines = []
+    inRecord = False
+    inSequence = False
+
+    for line in fp:
+        if not inRecord: # Skip file header before first locus
+            if not line.startswith("LOCUS"):
+                continue
+
+            inRecord = True
+
+        if line.startswith("//"): # End of locus
+            yield "".join(lines)
+            lines.clear()
+            inRecord = inSequence = False
+            continue
+
+        if inSequence: # Sequence data is discarded by the parser, skip without storing
+            continue
+
+        if line.startswith(_sequenceHeadings):
+            inSequence = True
+            continue
+
+        lines.append(line)
     
-def _parseEntry(entryBlock: str) -> dict:
+def findShards(filePath: Path, shardSize: int) -> list[tuple[int, int]]:
+    fileSize = filePath.stat().st_size
+    if filePath.suffix in (".gz", ".bz2", ".xz", ".zip") or fileSize <= shardSize: # Compressed streams can't be seeked into
+        return [(0, None)]
+
+    boundaries = [0]
+    with open(filePath, "rb") as fp:
+        while boundaries[-1] + shardSize < fileSize:
+            fp.seek(boundaries[-1] + shardSize)
+            fp.readline() # Partial line after seeking
+
+            for line in fp: # Next shard starts after the end of the current record
+                if line.startswith(b"//"):
+                    break
+
+            position = fp.tell()
+            if position >= fileSize:
+                break
+
+            boundaries.append(position)
+
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:] + [None])]
+
+def parseShard(filePath: Path, start: int, end: int | None, subfileDir: Path, shardName: str, batchSize: int = 5000, structured: bool = False) -> list[Path]:
+    subfileDir.mkdir(parents=True, exist_ok=True)
+
+    writtenFiles = []
+    for idx, batch in enumerate(iterBatches(filePath, batchSize, start=start, end=end, structured=structured)):
+        subfile = Subfile(subfileDir, f"{shardName}_{idx}", Format.PARQUET)
+        if structured:
+            pq.write_table(batch, subfile.filePath)
+        else:
+            subfile.write(batch)
+
+        writtenFiles.append(subfile.filePath)
+
+    return writtenFiles
+
+def _openRange(filePath: Path, start: int, end: int | None) -> IO[str]:
+    fp = open(filePath, "rb")
+    fp.seek(start)
+
+    stream = io.BufferedReader(_RangeReader(fp, end))
+    return io.TextIOWrapper(stream, encoding="utf-8")
+
+def _buildTable(records: list[dict]) -> pa.Table:
+    columns = list(dict.fromkeys(key for record in records for key in record))
+
+    arrays = []
+    for column in columns:
+        values = [record.get(column) for record in records]
+
+        arrowType = _nestedTypes.get(column)
+        if arrowType is None: # Undeclared columns such as dblinks may hold lists of values
+            arrowType = pa.list_(pa.string()) if any(isinstance(value, list) for value in values) else pa.string()
+
+        arrays.append(pa.array(values, arrowType))
+
+    return pa.Table.from_arrays(arrays, names=columns)
+
+def _buildRecord(entry: str, seqFileName: str, structured: bool = False) -> dict:
+    entryData = _parseEntry(entry, structured)
+
+    # Attach seq file path and fasta file
+    entryData["seq_file"] = f"{_seqBaseURL}{seqFileName}"
+    version = entryData.get("version", "")
+    if version:
+        entryData["genbank_url"] = f"{_genbankBaseURL}{version}"
+        entryData["fasta_url"] = f"{_genbankBaseURL}{version}{_fastaSuffix}"
+
+    # Add specimen field
+    specimenOptions = [
+        "specimen_voucher"
+        "isolate"
+        "accession"
+    ]
+
+    for idx, option in enumerate(specimenOptions, start=1):
+        value = entryData.get(option, None)
+        if value is not None:
+            if idx == len(specimenOptions):
+                value = f"NCBI_{value}_specimen"
+            entryData["specimen"] = value
+            break
+    else: # No specimen set
+        entryData["specimen"] = None
+
+    return entryData
+
+def _parseEntry(entryBlock: str, structured: bool = False) -> dict:
     splitSections = _getSections(entryBlock, allowDigits=False)
 
     entryData = {}
     for sectionBlock in splitSections:
         heading, data = sectionBlock.split(" ", 1)
 
-        if heading not in Section._value2member_map_:
+        section = Section._value2member_map_.get(heading)
+        if section is None:
             print(f"Unhandled heading: {heading}")
             continue
 
-        section = Section(heading)
         if section == Section.LOCUS:
             entryData |= _parseLocus(data)
 
@@ -119,7 +281,7 @@ def _parseEntry(entryBlock: str) -> dict:
                 entryData[key].append(value)
 
         elif section == Section.FEATURES:
-            entryData |= _parseFeatures(data)
+            entryData |= _parseFeatures(data, structured)
 
         elif section == Section.ORIGIN:
             pass
@@ -127,6 +289,12 @@ def _parseEntry(entryBlock: str) -> dict:
         elif section == Section.CONTIG:
             pass
 
+    if structured: # References missing authors default to an empty list, which isn't a valid list element
+        if "authors" in entryData:
+            entryData["authors"] = [authors if isinstance(authors, str) else None for authors in entryData["authors"]]
+
+        return entryData
+
     # Stringify columns so they can be saved as parqet/csv
     stringColumns = ["authors", "bases", "references"]
     for column in stringColumns:
@@ -210,7 +378,7 @@ def _parseReference(data: str, extract: dict) -> tuple[dict[str, str], dict[str,
 
     return reference, extracted
 
-def _parseFeatures(data: str) -> dict[str, str]:
+def _parseFeatures(data: str, structured: bool = False) -> dict[str, str | list]:
     featureBlocks = _getSections(data, 5)
     genes = {}
     otherProperties = {}
@@ -268,6 +436,15 @@ def _parseFeatures(data: str) -> dict[str, str]:
 
                 otherProperties[sectionHeader].append(properties)
     
+    if structured: # Flatten to lists of records so they can be stored as arrow structs
+        if genes:
+            features["genes"] = [{"gene": gene, "feature": header, "properties": list(properties.items())} for gene, headers in genes.items() for header, propertyList in headers.items() for properties in propertyList]
+
+        if otherProperties:
+            features["other_properties"] = [{"feature": header, "properties": list(properties.items())} for header, propertyList in otherProperties.items() for properties in propertyList]
+
+        return features
+
     # Only write genes and other properties if exists
     if genes:
         features["genes"] = str(genes)
@@ -278,31 +455,26 @@ def _parseFeatures(data: str) -> dict[str, str]:
     return features
 
 def _getSections(textBlock: str, whitespace: int = 0, allowDigits=True) -> list[str]:
-    sections = []
-    sectionStart = 0
-    searchPos = 0
     textBlock = textBlock.rstrip("\n") # Make sure block doesn't end with newlines
+    headerPattern = _getHeaderPattern(whitespace, allowDigits)
 
-    while True:
-        nextNewlinePos = textBlock.find("\n", searchPos)
-        nextPlus1 = nextNewlinePos + 1
-
-        if nextNewlinePos < 0: # No next new line
-            sections.append(textBlock[sectionStart:])
-            break
+    sections = []
+    sectionStart = 0
+    for match in headerPattern.finditer(textBlock):
+        sections.append(textBlock[sectionStart:match.start()])
+        sectionStart = match.end()
 
-        if len(textBlock[nextPlus1:nextPlus1+whitespace+1].strip()) == 0: # No header on next line
-            searchPos = nextPlus1
-            continue
+    sections.append(textBlock[sectionStart:])
+    return sections
 
-        if not allowDigits and textBlock[nextPlus1+whitespace+1].isdigit(): # Check for digit leading next header
-            searchPos = nextPlus1
-            continue
+@lru_cache
+def _getHeaderPattern(whitespace: int, allowDigits: bool) -> re.Pattern:
+    # A new section starts after a newline when the next whitespace+1 characters aren't all whitespace
+    pattern = rf"\n(?=\s{{0,{whitespace}}}\S)"
+    if not allowDigits: # Digit straight after the header column continues the current section
+        pattern += rf"(?!.{{{whitespace + 1}}}\d)"
 
-        sections.append(textBlock[sectionStart:nextNewlinePos])
-        sectionStart = searchPos = nextPlus1
+    return re.compile(pattern, re.DOTALL)
 
-    return sections
-    
 def _flattenBlock(textBlock: str, joiner: str = " ") -> str:
     return joiner.join(line.strip() for line in textBlock.split("\n") if line)
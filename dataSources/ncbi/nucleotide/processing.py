@@ -1,29 +1,53 @@
-from lib.tools.zipping import RepeatExtractor
 from lib.tools.bigFileWriter import BigFileWriter
+from lib.tools.logger import Logger
+from lib.processing.scripts import importModule
 from pathlib import Path
-from .. import flatFileParser as ffp
+import concurrent.futures
+import os
 
-def parseNucleotide(folderPath: Path, outputFilePath: Path, verbose: bool = True) -> None:
-    extractor = RepeatExtractor(outputFilePath.parent)
+ffp = importModule(Path(__file__).parents[1] / "flatFileParser.py") # Shared parser sits outside this source, load it by path as scripts are
+
+def parseNucleotide(folderPath: Path, outputFilePath: Path, verbose: bool = True, batchSize: int = 5000, workers: int = None, shardSize: int = 256 * 1024 * 1024, structured: bool = False) -> None:
     writer = BigFileWriter(outputFilePath, "seqChunks", "chunk")
+    files = sorted(folderPath.glob("*.seq.gz")) + sorted(folderPath.glob("*.seq"))
+
+    if structured and outputFilePath.suffix != ".parquet":
+        Logger.warning(f"Structured output keeps nested columns only in parquet, {outputFilePath.name} will store them as text")
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1:
+        for idx, file in enumerate(files, start=1):
+            if verbose:
+                print(f"Parsing file {file.name}")
+            else:
+                print(f"Processing file: {idx}", end="\r")
+
+            ffp.writeFlatfile(file, writer, batchSize, verbose, structured) # Decompressed and written in batches while parsing
+
+        writer.oneFile()
+        return
 
-    for idx, file in enumerate(folderPath.iterdir(), start=1):
-        if verbose:
-            print(f"Extracting file {file.name}")
-        else:
-            print(f"Processing file: {idx}", end="\r")
-    
-        extractedFile = extractor.extract(file)
+    # Compressed divisions are one task each, uncompressed files are split into byte ranges on record boundaries
+    tasks = []
+    for file in files:
+        shards = ffp.findShards(file, shardSize)
+        for shardIdx, (start, end) in enumerate(shards):
+            shardName = file.name.split(".")[0] if len(shards) == 1 else f"{file.name.split('.')[0]}_{shardIdx}"
+            tasks.append((file, start, end, shardName))
 
-        if extractedFile is None:
-            print(f"Failed to extract file {file.name}, skipping")
-            continue
+    Logger.info(f"Parsing {len(files)} files as {len(tasks)} tasks with {workers} workers")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(ffp.parseShard, file, start, end, writer.subfileDir, shardName, batchSize, structured) for file, start, end, shardName in tasks]
 
-        if verbose:
-            print(f"Parsing file {extractedFile}")
+        for idx, ((file, _, _, shardName), future) in enumerate(zip(tasks, futures), start=1): # Collected in submission order so output is deterministic
+            for subfilePath in future.result():
+                writer.addSubfile(subfilePath)
 
-        df = ffp.parseFlatfile(extractedFile, verbose)
-        writer.writeDF(df)
-        extractedFile.unlink()
+            if verbose:
+                Logger.info(f"Parsed {shardName} from {file.name} ({idx}/{len(tasks)})")
+            else:
+                print(f"Processing task: {idx}", end="\r")
 
     writer.oneFile()
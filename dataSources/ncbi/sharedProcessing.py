@@ -1,16 +1,16 @@
 from pathlib import Path
 from lib.tools.logger import Logger
 from lib.processing.stages import File
-from lib.tools.bigFileWriter import BigFileWriter
-import time
+from lib.tools.checkpoint import Checkpoint
+from lib.tools.rateLimiter import TokenBucket
+import lib.tools.downloading as dl
 import pandas as pd
 from lib.tools.progressBar import ProgressBar
-from threading import Thread
-from queue import Queue
-from typing import Generator
+import concurrent.futures
 import requests
+import time
 
-def enrichStats(summaryFile: File, outputPath: Path, apiKeyPath: Path = None):
+def enrichStats(summaryFile: File, outputPath: Path, apiKeyPath: Path = None, batchSize: int = 100, chunkSize: int = 10000):
     if apiKeyPath is not None and apiKeyPath.exists():
         Logger.info("Found API key")
         with open(apiKeyPath) as fp:
@@ -22,12 +22,7 @@ def enrichStats(summaryFile: File, outputPath: Path, apiKeyPath: Path = None):
         maxRequests = 3
 
     accessionCol = "#assembly_accession"
-    df = summaryFile.loadDataFrame(dtype=object)
-
-    subFile = outputPath.parent / "apiData.csv"
-    writer = BigFileWriter(subFile)
-    writer.populateFromFolder(writer.subfileDir)
-    writtenFileCount = len(writer.writtenFiles)
+    accessions = [accession for chunk in summaryFile.loadDataFrameIterator(chunkSize) for accession in chunk[accessionCol].dropna()]
 
     summaryFields = {
         "assembly_name": "asm_name",
@@ -44,77 +39,133 @@ def enrichStats(summaryFile: File, outputPath: Path, apiKeyPath: Path = None):
         "non_coding_gene_count": "non_coding_gene_count"
     }
 
+    checkpoint = Checkpoint(outputPath.parent / "apiProgress.sqlite") # Retrieved records by accession, previously failed accessions are retried
+    pending = checkpoint.getPending(accessions)
+    Logger.info(f"Retrieving {len(pending)} of {len(accessions)} accessions")
+
+    limiter = TokenBucket(maxRequests)
+    workerCount = maxRequests * 2 # Extra workers keep requests going while others wait on responses
+    session = dl.buildSession(workerCount)
+    batches = [pending[start:start + batchSize] for start in range(0, len(pending), batchSize)]
+
     progress = ProgressBar()
-    totalRecords = len(df)
-
-    recordsPerSubsection = 30000
-    iterations = (totalRecords / recordsPerSubsection).__ceil__()
-
-    queue = Queue()
-    for iteration in range(writtenFileCount, iterations):
-        workerRecordCount = (recordsPerSubsection / maxRequests).__ceil__()
-        workers: dict[int, Thread] = {}
-
-        for i in range(maxRequests):
-            startRange = (i + iteration) * workerRecordCount
-            endRange = (i + iteration + 1) * workerRecordCount
-            accessions = (accession for accession in df[accessionCol][startRange:endRange])
-            worker = Thread(target=apiWorker, args=(i, accessions, apiKey, set(summaryFields), queue), daemon=True)
-            worker.start()
-            workers[i] = worker
-            time.sleep(1 / maxRequests)
-
-        recordData = []
-        failedAccessions = []
-        while workers:
-            value = queue.get()
-            if isinstance(value, tuple): # Worker done idx and failed entries
-                idx, failed = value
-                worker = workers.pop(idx)
-                worker.join()
-                failedAccessions.extend(failed)
-            else: # Record
-                recordData.append(value)
-                
-            progress.update((len(recordData) + len(failedAccessions)) / recordsPerSubsection)
-
-        print(f"\nCompleted subsection {iteration}")
-        writer.writeDF(pd.DataFrame.from_records(recordData))
-
-    writer.oneFile(True)
-    # print(f"Failed: {failedAccessions}")
-
-    df.merge(pd.read_csv(subFile), how="outer", left_on="#assembly_accession", right_on="current_accession").to_csv(outputPath, index=False)
-
-def apiWorker(idx: int, accessions: Generator[str, None, None], apiKey: str, dropKeys: set, queue: Queue) -> list[dict]:
-    session = requests.Session()
-    failed = []
-    for accession in accessions:
-        url = f"https://api.ncbi.nlm.nih.gov/datasets/v2alpha/genome/accession/{accession}/dataset_report"
-        headers = {
-            "accept": "application/json",
-            "api-key": apiKey
-        }
+    completed = 0
+    failedCount = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workerCount) as executor:
+        futures = [executor.submit(retrieveBatch, session, batch, apiKey, limiter, set(summaryFields)) for batch in batches]
 
         try:
-            response = session.get(url, headers=headers)
-            data = response.json()
-            reports = data.get("reports", [])
+            for future in concurrent.futures.as_completed(futures):
+                records, failed = future.result()
+                checkpoint.markDone(records)
+                checkpoint.markFailed(failed)
+
+                completed += len(records) + len(failed)
+                failedCount += len(failed)
+                progress.update(completed / len(pending), f"{failedCount} failed")
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            raise
+
+    print()
+    if failedCount:
+        Logger.warning(f"Unable to retrieve {failedCount} accessions, these will be retried on next run")
+
+    _writeMerged(summaryFile, checkpoint, accessionCol, outputPath, chunkSize)
+
+def _writeMerged(summaryFile: File, checkpoint: Checkpoint, accessionCol: str, outputPath: Path, chunkSize: int) -> None:
+    apiColumns = {}
+    for _, record in checkpoint.iterDone(): # Column union in order of first appearance
+        apiColumns |= dict.fromkeys(record)
+
+    for idx, chunk in enumerate(summaryFile.loadDataFrameIterator(chunkSize)):
+        records = checkpoint.getMany(chunk[accessionCol].dropna().tolist())
+        apiData = pd.DataFrame([records.get(accession, {}) for accession in chunk[accessionCol]], columns=list(apiColumns), index=chunk.index, dtype=object)
+        pd.concat([chunk, apiData], axis=1).to_csv(outputPath, mode="w" if idx == 0 else "a", header=(idx == 0), index=False)
+
+def retrieveBatch(session: requests.Session, accessions: list[str], apiKey: str, limiter: TokenBucket, dropKeys: set) -> tuple[dict[str, dict], list[str]]:
+    try:
+        reports = getReports(session, accessions, apiKey, limiter)
+    except requests.exceptions.RequestException: # Server still unavailable after retrying, splitting would only add requests
+        return {}, accessions
+
+    if reports is None: # Request rejected, split batch to isolate bad accessions
+        if len(accessions) == 1:
+            return {}, accessions
+
+        midpoint = len(accessions) // 2
+        firstRecords, firstFailed = retrieveBatch(session, accessions[:midpoint], apiKey, limiter, dropKeys)
+        secondRecords, secondFailed = retrieveBatch(session, accessions[midpoint:], apiKey, limiter, dropKeys)
+        return firstRecords | secondRecords, firstFailed + secondFailed
+
+    requested = set(accessions)
+    records = {}
+    for report in reports:
+        accession = report.get("accession", "")
+        if accession not in requested: # Report may be for a newer version than requested
+            accession = report.get("current_accession", "")
+            if accession not in requested:
+                continue
+
+        record = parseRecord(report)
+        records[accession] = {key: value for key, value in record.items() if key not in dropKeys} # Drop duplicate keys with summary
 
-        except: # Failed to retrieve, skip
-            reports = []
+    return records, [accession for accession in accessions if accession not in records]
+
+def getReports(session: requests.Session, accessions: list[str], apiKey: str, limiter: TokenBucket, pageSize: int = 1000, retries: int = 5) -> list[dict] | None:
+    url = f"https://api.ncbi.nlm.nih.gov/datasets/v2alpha/genome/accession/{','.join(accessions)}/dataset_report"
+    headers = {
+        "accept": "application/json",
+        "api-key": apiKey
+    }
+
+    reports = []
+    params = {"page_size": pageSize}
+    attempt = 0
+    while True:
+        limiter.acquire()
+
+        try:
+            response = session.get(url, headers=headers, params=params)
+            retryable = response.status_code == 429 or response.status_code >= 500
+            if not retryable and response.status_code >= 400: # Bad input such as an invalid accession
+                return None
+
+            if not retryable:
+                data = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e: # Connection problems and truncated bodies are retried
+            retryable = True
+            response = getattr(e, "response", None)
+
+        if retryable:
+            attempt += 1
+            if attempt > retries:
+                raise requests.exceptions.RetryError(f"Unable to retrieve reports after {retries} retries")
+
+            delay = _retryDelay(response, attempt)
+            if response is not None and response.status_code == 429: # Throttled, slow every worker down and wait through the limiter
+                limiter.penalise(delay)
+            else:
+                time.sleep(delay)
 
-        lastRetrieve = time.time()
-        if not reports:
-            failed.append(accession)
             continue
 
-        record = parseRecord(reports[0])
-        record = {key: value for key, value in record.items() if key not in dropKeys} # Drop duplicate keys with summary
-        queue.put(record)
-        time.sleep(1.05 - (time.time() - lastRetrieve))
+        reports.extend(data.get("reports", []))
+
+        nextPage = data.get("next_page_token", "")
+        if not nextPage:
+            return reports
+
+        params["page_token"] = nextPage
+        attempt = 0
+
+def _retryDelay(response: requests.Response | None, attempt: int) -> float:
+    retryAfter = response.headers.get("Retry-After", "") if response is not None else ""
+    if retryAfter.isdigit():
+        return float(retryAfter)
 
-    queue.put((idx, failed))
+    return float(2 ** attempt)
 
 def parseRecord(record: dict) -> dict:
     def _extractKeys(d: dict, keys: list[str], prefix: str = "", suffix: str = "") -> dict:
@@ -1,8 +1,13 @@
 from pathlib import Path
+import io
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+from typing import IO
 from enum import Enum
 from lib.tools.logger import Logger
-from lib.tools.progressBar import SteppableProgressBar
+import lib.tools.zipping as zp
 
 class DumpFile(Enum):
     NODES = "nodes.dmp"
@@ -66,91 +71,127 @@ headings = {
     ]
 }
 
-class Node:
-    __slots__ = headings[DumpFile.NODES]
+# Identifier and flag columns are typed, anything else is read as a string
+columnTypes = {column: pa.int64() for column in ("tax_id", "parent_tax_id", "division_id", "genetic_code_id", "mitochondrial_genetic_code_id", "old_tax_id", "new_tax_id")}
+columnTypes |= {column: pa.int8() for column in ("inherited_div_flag", "inherited_GC_flag", "inherited_MGC_flag", "GenBank_hidden_flag", "hidden_subtree_root_flag")}
 
-    inheritedAttrs = {
-        "inherited_div_flag": "division_id",
-        "inherited_GC_flag": "genetic_code_id",
-        "inherited_MGC_flag": "mitochondrial_genetic_code_id",
-    }
-
-    hiddenAttrs = [
-        "GenBank_hidden_flag",
-        "hidden_subtree_root_flag"
-    ]
-
-    def __init__(self, **kwargs):
-        for k, v in kwargs.items():
-            if k in self.hiddenAttrs or k in self.inheritedAttrs:
-                v = bool(int(v))
-
-            setattr(self, k, v)
-
-    def resolveInherit(self, nodes: dict[int, 'Node']) -> None:
-        for flagAttr, valueAttr in self.inheritedAttrs.items():
-            if getattr(self, flagAttr):
-                parentNode = nodes[self.parent_tax_id]
-                parentNode.resolveInherit(nodes)
-                setattr(self, flagAttr, False)
-                setattr(self, valueAttr, getattr(parentNode, valueAttr))
+inheritedAttrs = {
+    "inherited_div_flag": "division_id",
+    "inherited_GC_flag": "genetic_code_id",
+    "inherited_MGC_flag": "mitochondrial_genetic_code_id",
+}
 
-    def package(self) -> dict:
-        return {attr: getattr(self, attr) for attr in self.__slots__ if attr not in self.inheritedAttrs and attr not in self.hiddenAttrs}
+hiddenAttrs = [
+    "GenBank_hidden_flag",
+    "hidden_subtree_root_flag"
+]
 
 def resolveInheritance(data: pd.DataFrame) -> pd.DataFrame:
-    nodes: dict[str, Node] = {}
-    nodeProgress = SteppableProgressBar(len(data), processName="Creating Nodes")
-    for _, row in data.iterrows():
-        node = Node(**row.to_dict())
-        nodes[node.tax_id] = node
-        nodeProgress.update()
-
-    records = []
-    recordProgress = SteppableProgressBar(len(nodes), processName="Resolving Inheritance")
-    for node in nodes.values():
-        node.resolveInherit(nodes)
-        records.append(node.package())
-        recordProgress.update()
-
-    return pd.DataFrame.from_records(records)
-
-def flattenNames(df: pd.DataFrame) -> pd.DataFrame:
-    data = {}
-    flattenProgress = SteppableProgressBar(len(df), processName="Flattening Names")
-    for _, row in df.iterrows():
-        taxID = row["tax_id"]
-        text = row["name_txt"]
-        nameClass = row["name_class"]
-
-        if taxID not in data:
-            data[taxID] = {"tax_id": taxID}
-
-        data[taxID][nameClass] = text
-        
-        flattenProgress.update()
-
-    return pd.DataFrame.from_dict(data, orient="index")
-
-def parse(dumpFolder: Path, outputFile: Path) -> None:
-
-    def loadDF(dumpFile: DumpFile) -> pd.DataFrame:
-        with open(dumpFolder / dumpFile.value) as fp:
-            records = [line.strip("\t|\n").split("\t|\t") for line in fp.readlines()]
-
-        return pd.DataFrame.from_records(records, columns=headings[dumpFile])
-
-    df = loadDF(DumpFile.NODES)
+    taxIDs = pd.Index(data["tax_id"])
+    parents = taxIDs.get_indexer(data["parent_tax_id"])
+
+    positions = np.arange(len(data))
+    parents = np.where(parents < 0, positions, parents) # Unknown parents resolve to the node itself
+
+    data = data.copy()
+    for flagAttr, valueAttr in inheritedAttrs.items():
+        flags = data[flagAttr].astype(int).to_numpy().astype(bool)
+
+        # Each node points at its parent while inheriting, pointer jumping then converges every node
+        # on its nearest non-inheriting ancestor in log(depth) vectorised passes
+        source = np.where(flags, parents, positions)
+        while True:
+            nextSource = source[source]
+            if np.array_equal(nextSource, source):
+                break
+
+            source = nextSource
+
+        data[valueAttr] = data[valueAttr].to_numpy()[source]
+
+    return data.drop(columns=list(inheritedAttrs) + hiddenAttrs).reset_index(drop=True)
+
+def flattenNames(df: pd.DataFrame, separator: str = " | ") -> pd.DataFrame:
+    # Taxa with several names of one class, such as multiple synonyms, keep all of them joined in file order
+    names = df.groupby(["tax_id", "name_class"], sort=False)["name_txt"].agg(separator.join).unstack("name_class")
+    names = names.reindex(index=df["tax_id"].unique(), columns=df["name_class"].unique())
+    names.columns.name = None
+    return names.rename_axis("tax_id").reset_index()
+
+class _DumpStream(io.RawIOBase):
+    def __init__(self, stream: IO[bytes], chunkSize: int = 16*1024*1024):
+        self._stream = stream
+        self._chunkSize = chunkSize
+        self._buffer = b""
+        self._leftover = b""
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def _fill(self) -> None:
+        while not self._buffer and not self._eof:
+            chunk = self._leftover + self._stream.read(self._chunkSize)
+            if len(chunk) == len(self._leftover): # Nothing more to read
+                self._eof = True
+                self._buffer = chunk
+                break
+
+            lineEnd = chunk.rfind(b"\n") + 1 # Only whole lines are translated so separators aren't split between chunks
+            self._buffer, self._leftover = chunk[:lineEnd], chunk[lineEnd:]
+
+        # Dump rows are "field\t|\tfield\t|\n", translated to plain tab separated rows
+        self._buffer = self._buffer.replace(b"\t|\n", b"\n").replace(b"\t|\t", b"\t")
+        if self._eof and self._buffer.endswith(b"\t|"): # Final row without a newline
+            self._buffer = self._buffer[:-2]
+
+    def readinto(self, buffer: memoryview) -> int:
+        if not self._buffer:
+            self._fill()
+
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def close(self) -> None:
+        self._stream.close()
+        super().close()
+
+def loadDump(dumpPath: Path, dumpFile: DumpFile) -> pd.DataFrame:
+    if dumpPath.is_dir():
+        stream = open(dumpPath / dumpFile.value, "rb")
+    else: # Read directly from downloaded archive
+        stream = zp.openStream(dumpPath, dumpFile.value, binary=True)
+
+    # Newer dumps may append columns, generated names let only the known leading columns be kept
+    columns = {f"f{idx}": column for idx, column in enumerate(headings[dumpFile])}
+    with _DumpStream(stream) as fp:
+        table = pacsv.read_csv(
+            fp,
+            read_options=pacsv.ReadOptions(autogenerate_column_names=True),
+            parse_options=pacsv.ParseOptions(delimiter="\t", quote_char=False, escape_char=False),
+            convert_options=pacsv.ConvertOptions(
+                include_columns=list(columns),
+                column_types={name: columnTypes.get(column, pa.string()) for name, column in columns.items()},
+                strings_can_be_null=False
+            )
+        )
+
+    return table.rename_columns(list(columns.values())).to_pandas()
+
+def parse(dumpPath: Path, outputFile: Path) -> None:
+    df = loadDump(dumpPath, DumpFile.NODES)
     df = resolveInheritance(df)
 
     # df = df[["tax_id", "parent_tax_id", "rank"]]
 
-    names = loadDF(DumpFile.NAMES)
+    names = loadDump(dumpPath, DumpFile.NAMES)
     names = flattenNames(names)
 
     df = df.merge(names, "left", on="tax_id")
 
-    divisions = loadDF(DumpFile.DIVISION)
+    divisions = loadDump(dumpPath, DumpFile.DIVISION)
     divisions = divisions.drop(["comments"], axis=1)
     df = df.merge(divisions, "left", on="division_id")
 
@@ -1,4 +1,4 @@
-import requests
+import lib.tools.httpClient as hc
 import math
 import pandas as pd
 from pathlib import Path
@@ -43,7 +43,7 @@ def build(outputFilePath: Path) -> None:
     }
 
     hitCountURL = "https://portal.tern.org.au/search/filter/TotalHitCountCollector/"
-    hitCounts = requests.post(hitCountURL)
+    hitCounts = hc.post(hitCountURL)
     hits = hitCounts.json()["json"]["total_docs"]
     hitsPerCall = 1000
 
@@ -55,7 +55,7 @@ def build(outputFilePath: Path) -> None:
     for call in range(totalCalls):
         parameters["params"]["page"] = call + 1
 
-        response = requests.post(baseURL, json=parameters)
+        response = hc.post(baseURL, json=parameters)
         data = response.json()
         records.extend(data["json"]["hits"])
     
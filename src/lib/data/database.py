@@ -7,6 +7,7 @@ from lib.systemManagers.processing import ProcessingManager
 from lib.systemManagers.conversion import ConversionManager
 from lib.systemManagers.metadata import MetadataManager
 from lib.systemManagers.updating import UpdateManager
+from lib.systemManagers.cleanup import CleanupManager
 
 from lib.processing.stages import Step
 
@@ -37,6 +38,7 @@ class BasicDB:
         self.processingConfig: dict = config.pop("processing", {})
         self.conversionConfig: dict = config.pop("conversion", {})
         self.updateConfig: dict = config.pop("update", {})
+        self.cleanupConfig: dict = config.pop("cleanup", {})
 
         if self.downloadConfig is None:
             raise Exception("No download config specified as required") from AttributeError
@@ -51,8 +53,9 @@ class BasicDB:
         self.convertedDir = self.dataDir / "converted"
 
         # System Managers
-        self.downloadManager = DownloadManager(self.databaseDir, self.downloadDir, self.authFile)
-        self.processingManager = ProcessingManager(self.databaseDir, self.processingDir)
+        self.cleanupManager = CleanupManager(self.dataDir, self.cleanupConfig)
+        self.downloadManager = DownloadManager(self.databaseDir, self.downloadDir, self.authFile, self.cleanupManager, self.downloadConfig.pop("workers", 1), self.downloadConfig.pop("hostLimit", 0))
+        self.processingManager = ProcessingManager(self.databaseDir, self.processingDir, self.cleanupManager)
         self.conversionManager = ConversionManager(self.databaseDir, self.convertedDir, self.datasetID, location, database, subsection)
         self.metadataManager = MetadataManager(self.subsectionDir)
         self.updateManager = UpdateManager(self.updateConfig)
@@ -80,6 +83,7 @@ class BasicDB:
             url = file.get("url", None)
             name = file.get("name", None)
             properties = file.get("properties", {})
+            checksum = file.get("checksum", {})
 
             if url is None:
                 raise Exception("No url provided for source") from AttributeError
@@ -87,7 +91,7 @@ class BasicDB:
             if name is None:
                 raise Exception("No filename provided to download to") from AttributeError
             
-            self.downloadManager.registerFromURL(url, name, properties)
+            self.downloadManager.registerFromURL(url, name, properties, checksum)
     
     def _prepareProcessing(self, overwrite: bool, verbose: bool) -> None:
         specificProcessing: dict[int, list[dict]] = self.processingConfig.pop("specific", {})
@@ -188,10 +192,12 @@ class CrawlDB(BasicDB):
 
     def _prepareDownload(self, overwrite: bool, verbose: bool) -> None:
         properties = self.downloadConfig.pop("properties", {})
+        checksum = self.downloadConfig.pop("checksum", {})
         folderPrefix = self.downloadConfig.pop("prefix", False)
         saveFile = self.downloadConfig.pop("saveFile", "crawl.txt")
         saveFilePath: Path = self.subsectionDir / saveFile
 
+        changedURLs = set()
         if saveFilePath.exists() and not overwrite:
             Logger.info("Local file found, skipping crawling")
             with open(saveFilePath) as fp:
@@ -199,16 +205,24 @@ class CrawlDB(BasicDB):
         else:
             saveFilePath.unlink(True)
 
-            urls = self._crawl(saveFilePath.parent)
+            crawler = self._crawl(saveFilePath.parent, overwrite)
+            if crawler.pendingCount(): # Interrupted crawl, saving or downloading its partial results would pass them off as complete
+                raise AttributeError("Crawl did not finish, rerun to resume from saved progress") # Fails the step during preparation
+
             saveFilePath.parent.mkdir(parents=True, exist_ok=True) # Create base directory if it doesn't exist to put the file
+            urls = []
             with open(saveFilePath, 'w') as fp:
-                fp.write("\n".join(urls))
+                for url in crawler.iterURLs(): # Stream matches from crawler store
+                    fp.write(f"{url}\n")
+                    urls.append(url)
+
+            changedURLs = set(crawler.getChanges().get("changed", []))
 
         for url in urls:
             fileName = self._getFileNameFromURL(url, folderPrefix)
-            self.downloadManager.registerFromURL(url, fileName, properties)
+            self.downloadManager.registerFromURL(url, fileName, properties, checksum, url in changedURLs) # Changed files are checked against remote even if already downloaded
 
-    def _crawl(self, crawlerDirectory: Path) -> None:
+    def _crawl(self, crawlerDirectory: Path, overwrite: bool) -> Crawler:
         url = self.downloadConfig.pop("url", None)
         regex = self.downloadConfig.pop("regex", ".*")
         link = self.downloadConfig.pop("link", "")
@@ -219,8 +233,8 @@ class CrawlDB(BasicDB):
         if url is None:
             raise Exception("No file location for source") from AttributeError
         
-        crawler.crawl(url, True)
-        return crawler.getURLList()
+        crawler.crawl(url, overwrite) # Resumes an unfinished frontier unless overwriting
+        return crawler
     
     def _getFileNameFromURL(self, url: str, folderPrefix: bool) -> str:
         urlParts = url.split('/')
@@ -2,6 +2,9 @@ from pathlib import Path
 from lib.processing.stages import File, Folder
 from lib.tools.logger import Logger
 import importlib.util
+from types import ModuleType
+import sys
+import re
 from enum import Enum
 import traceback
 import lib.config as cfg
@@ -38,6 +41,7 @@ class Script:
         # Output information
         self.output = scriptInfo.pop("output", "")
         self.outputProperties = scriptInfo.pop("properties", {})
+        self.scratch: list[str] = scriptInfo.pop("scratch", [])
 
         for parameter in scriptInfo:
             Logger.debug(f"Unknown step parameter: {parameter}")
@@ -56,6 +60,8 @@ class Script:
         else:
             self.output: File = File(self.output, self.outputProperties)
 
+        self.scratch = [self._parseScratch(path) for path in self.scratch]
+
         self.args = [self._parseArg(arg) for arg in self.args]
         self.kwargs = {key: self._parseArg(arg) for key, arg in self.kwargs.items()}
 
@@ -113,10 +119,11 @@ class Script:
         return True
     
     def _importFunction(self, modulePath: Path, functionName: str) -> callable:
-        spec = importlib.util.spec_from_file_location(modulePath.name, modulePath)
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
-        return getattr(module, functionName)
+        return getattr(importModule(modulePath), functionName)
+
+    def _parseScratch(self, path: str) -> Path:
+        path = self._parseArg(path, [Key.OUTPUT_DIR, Key.OUTPUT_PATH])
+        return path if isinstance(path, Path) else self.outputDir / path
 
     def _parseArg(self, arg: any, excludeKeys: list[Key] = []) -> Path | str:
         if not isinstance(arg, str):
@@ -210,3 +217,11 @@ class Script:
 
         Logger.warning(f"Unable to parse suspected path: {arg}")
         return arg
+
+def importModule(modulePath: Path) -> ModuleType:
+    moduleName = re.sub(r"\W", "_", str(modulePath.resolve().with_suffix(""))) # Unique importable name lets functions be pickled to worker processes
+    spec = importlib.util.spec_from_file_location(moduleName, modulePath)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[moduleName] = module
+    spec.loader.exec_module(module)
+    return module
@@ -1,8 +1,10 @@
 import pandas as pd
 import lib.commonFuncs as cmn
+import lib.tools.zipping as zp
 from pathlib import Path
 from enum import Enum
 from collections.abc import Iterator
+from typing import IO
 from lib.tools.logger import Logger
 
 class Step(Enum):
@@ -55,11 +57,20 @@ class File:
     
     def delete(self) -> None:
         self.filePath.unlink(True)
+
+    def isCompressed(self) -> bool:
+        return zp.canBeExtracted(self.filePath)
+
+    def getMembers(self) -> list[str]:
+        return zp.listMembers(self.filePath)
+
+    def open(self, member: str = None, binary: bool = False) -> IO:
+        return zp.openStream(self.filePath, member, binary, self.encoding)
     
     def loadDataFrame(self, offset: int = 0, rows: int = None, **kwargs: dict) -> pd.DataFrame:
         return pd.read_csv(self.filePath, sep=self.separator, header=self.firstRow + offset, encoding=self.encoding, nrows=rows, **kwargs)
     
-    def loadDataFrameIterator(self, chunkSize: int = 1024, offset: int = 0, rows: int = -1) -> Iterator[pd.DataFrame]:
+    def loadDataFrameIterator(self, chunkSize: int = 1024, offset: int = 0, rows: int = None) -> Iterator[pd.DataFrame]:
         return cmn.chunkGenerator(self.filePath, chunkSize, self.separator, self.firstRow + offset, self.encoding, nrows=rows)
 
     def getColumns(self) -> list[str]:
@@ -0,0 +1,156 @@
+from pathlib import Path
+from enum import Enum
+from lib.processing.stages import File, Folder
+from lib.tools.logger import Logger
+import lib.tools.zipping as zp
+from datetime import datetime
+
+class Action(Enum):
+    DELETE   = "delete"
+    COMPRESS = "compress"
+
+class CleanupManager:
+    _units = {
+        "B": 1,
+        "KB": 1024,
+        "MB": 1024**2,
+        "GB": 1024**3,
+        "TB": 1024**4
+    }
+
+    def __init__(self, dataDir: Path, cleanupConfig: dict):
+        self.dataDir = dataDir
+        self.enabled = bool(cleanupConfig)
+
+        self.budget = self._parseSize(cleanupConfig.pop("budget", 0))
+        self.action = Action(cleanupConfig.pop("action", Action.DELETE.value))
+        self.keepDownloads = cleanupConfig.pop("keepDownloads", False)
+
+        for property in cleanupConfig:
+            Logger.debug(f"Unknown cleanup parameter: {property}")
+
+        self._consumers: dict[Path, int] = {}
+        self._protected: set[Path] = set()
+        self._downloads: set[Path] = set()
+        self._released: list[Path] = []
+
+    def _parseSize(self, size: int | str) -> int:
+        if isinstance(size, int):
+            return size
+
+        size = size.strip().upper()
+        for unit, multiplier in sorted(self._units.items(), key=lambda x: len(x[0]), reverse=True):
+            if size.endswith(unit):
+                return int(float(size[:-len(unit)]) * multiplier)
+
+        return int(size)
+
+    def _formatSize(self, size: int) -> str:
+        for unit, multiplier in sorted(self._units.items(), key=lambda x: x[1], reverse=True):
+            if abs(size) >= multiplier:
+                return f"{size / multiplier:.2f}{unit}"
+
+        return f"{size}B"
+
+    def _getSize(self, path: Path) -> int:
+        if not path.exists():
+            return 0
+
+        if path.is_file():
+            return path.stat().st_size
+
+        return sum(item.stat().st_size for item in path.rglob("*") if item.is_file())
+
+    def registerDownload(self, file: File) -> None:
+        self._downloads.add(file.filePath)
+
+    def addConsumer(self, file: File) -> None:
+        self._consumers[file.filePath] = self._consumers.get(file.filePath, 0) + 1
+
+    def protect(self, file: File) -> None:
+        self._protected.add(file.filePath)
+
+    def release(self, file: File) -> list[dict]:
+        if not self.enabled:
+            return []
+
+        path = file.filePath
+        if path not in self._consumers:
+            return []
+
+        self._consumers[path] -= 1
+        if self._consumers[path] > 0: # Other consumers still need this file
+            return []
+
+        self._consumers.pop(path)
+        if path in self._protected or (self.keepDownloads and path in self._downloads):
+            return []
+
+        self._released.append(path)
+        return self.enforceBudget()
+
+    def releaseScratch(self, scratchPaths: list[Path]) -> list[dict]:
+        if not self.enabled:
+            return []
+
+        # Only paths a step declares as scratch are released, other files it leaves beside its output may be used later
+        keepPaths = self._protected | set(self._consumers) | self._downloads
+        for path in scratchPaths:
+            if path in keepPaths or path in self._released or not path.exists():
+                continue
+
+            self._released.append(path)
+
+        return self.enforceBudget()
+
+    def enforceBudget(self) -> list[dict]:
+        if not self.enabled or not self._released:
+            return []
+
+        usage = self._getSize(self.dataDir)
+        if usage <= self.budget:
+            return []
+
+        Logger.info(f"Data directory uses {self._formatSize(usage)} which exceeds budget of {self._formatSize(self.budget)}, cleaning up")
+
+        actions = []
+        while self._released and usage > self.budget:
+            path = self._released.pop(0)
+            if not path.exists():
+                continue
+
+            itemSize = self._getSize(path)
+            if self.action == Action.COMPRESS and not (path.is_file() and zp.canBeExtracted(path)):
+                outputPath = zp.compress(path)
+                if outputPath is None:
+                    continue
+
+                self._remove(path)
+                freed = itemSize - outputPath.stat().st_size
+                actionName = "compressed"
+            elif self.action == Action.DELETE:
+                self._remove(path)
+                freed = itemSize
+                actionName = "deleted"
+            else: # Already compressed and not allowed to delete
+                continue
+
+            Logger.info(f"Cleanup {actionName} {path}, freeing {self._formatSize(freed)}")
+            usage -= freed
+            actions.append({
+                "path": str(path.relative_to(self.dataDir)) if path.is_relative_to(self.dataDir) else str(path),
+                "action": actionName,
+                "freed": freed,
+                "timestamp": datetime.now().isoformat()
+            })
+
+        if usage > self.budget:
+            Logger.warning(f"Unable to bring data directory under budget, still using {self._formatSize(usage)}")
+
+        return actions
+
+    def _remove(self, path: Path) -> None:
+        if path.is_file():
+            File(path).delete()
+        else:
+            Folder(path).delete()
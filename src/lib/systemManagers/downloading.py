@@ -2,8 +2,14 @@ from pathlib import Path
 import lib.commonFuncs as cmn
 from lib.processing.stages import File
 from lib.processing.scripts import Script
+from lib.systemManagers.cleanup import CleanupManager
 from lib.tools.logger import Logger
 import lib.tools.downloading as dl
+from lib.tools.progressBar import SteppableProgressBar
+import concurrent.futures
+import threading
+import urllib.parse
+import requests
 import time
 from datetime import datetime
 
@@ -15,19 +21,23 @@ class _Download:
         raise NotImplementedError
 
 class _URLDownload(_Download):
-    def __init__(self, url: str, filePath: Path, properties: dict, username: str, password: str):
+    def __init__(self, url: str, filePath: Path, properties: dict, username: str, password: str, checksum: dict, refresh: bool):
         self.url = url
         self.auth = dl.buildAuth(username, password) if username else None
+        self.checksum = checksum
+        self.refresh = refresh
 
         super().__init__(filePath, properties)
 
-    def retrieve(self, overwrite: bool, verbose: bool) -> bool:
-        if not overwrite and self.file.exists():
+    def getHost(self) -> str:
+        return urllib.parse.urlparse(self.url).netloc
+
+    def retrieve(self, overwrite: bool, verbose: bool, session: requests.Session = None) -> bool:
+        if not overwrite and not self.refresh and self.file.exists():
             Logger.info(f"Output file {self.file.filePath} already exists")
-            return self.file.filePath
+            return True
         
-        self.file.filePath.unlink(True)
-        return dl.download(self.url, self.file.filePath, verbose=verbose, auth=self.auth)
+        return dl.download(self.url, self.file.filePath, verbose=verbose, auth=self.auth, session=session, checksum=self.checksum, overwrite=overwrite)
 
 class _ScriptDownload(_Download):
     def __init__(self, baseDir: Path, downloadDir: Path, scriptInfo: dict):
@@ -39,10 +49,13 @@ class _ScriptDownload(_Download):
         return self.script.run(overwrite, verbose)
 
 class DownloadManager:
-    def __init__(self, baseDir: Path, downloadDir: Path, authFile: str):
+    def __init__(self, baseDir: Path, downloadDir: Path, authFile: str, cleanupManager: CleanupManager, workers: int = 1, hostLimit: int = 0):
         self.baseDir = baseDir
         self.downloadDir = downloadDir
         self.authFile = authFile
+        self.cleanupManager = cleanupManager
+        self.workers = workers
+        self.hostLimit = hostLimit
 
         authPath = self.baseDir / self.authFile
         if authFile and authPath.exists():
@@ -64,32 +77,94 @@ class DownloadManager:
     def getLatestFile(self) -> File:
         return self.files[-1].file
 
-    def download(self, overwrite: bool = False, verbose: bool = False) -> tuple[bool, dict]:
+    def download(self, overwrite: bool = False, verbose: bool = False, workers: int = None, hostLimit: int = None) -> tuple[bool, dict]:
         if not self.downloadDir.exists():
             self.downloadDir.mkdir(parents=True)
 
+        workers = self.workers if workers is None else workers
+        hostLimit = self.hostLimit if hostLimit is None else hostLimit
+
         metadata = {"files": []}
-        allSucceeded = True
         startTime = time.perf_counter()
 
-        for download in self.downloads:
-            downloadStart = time.perf_counter()
+        urlDownloads = [download for download in self.downloads if isinstance(download, _URLDownload)]
+        if workers > 1 and len(urlDownloads) > 1:
+            for download in self.downloads: # Scripts manage their own requests, run them first
+                if download not in urlDownloads:
+                    metadata["files"].append(self._retrieve(download, overwrite, verbose))
+
+            metadata["files"].extend(self._retrieveConcurrent(urlDownloads, overwrite, verbose, workers, hostLimit))
+        else:
+            session = dl.buildSession()
+            for download in self.downloads:
+                metadata["files"].append(self._retrieve(download, overwrite, verbose, session))
+
+        metadata["totalTime"] = time.perf_counter() - startTime
+        return all(fileMetadata["success"] for fileMetadata in metadata["files"]), metadata
+
+    def _retrieve(self, download: _Download, overwrite: bool, verbose: bool, session: requests.Session = None) -> dict:
+        snapshot = self.cleanupManager.snapshot(self.downloadDir)
+        downloadStart = time.perf_counter()
+
+        if isinstance(download, _URLDownload):
+            success = download.retrieve(overwrite, verbose, session)
+        else:
             success = download.retrieve(overwrite, verbose)
 
-            metadata["files"].append({
-                "output": download.file.filePath.name,
-                "success": success,
-                "duration": time.perf_counter() - downloadStart,
-                "timestamp": datetime.now().isoformat()
-            })
+        fileMetadata = {
+            "output": download.file.filePath.name,
+            "success": success,
+            "duration": time.perf_counter() - downloadStart,
+            "timestamp": datetime.now().isoformat()
+        }
 
-            allSucceeded = allSucceeded and success
+        if success and isinstance(download, _URLDownload): # Record size and digest computed while downloading
+            info = dl.loadInfo(download.file.filePath)
+            fileMetadata |= {key: value for key, value in info.items() if key not in ("url", "etag", "lastModified")}
 
-        metadata["totalTime"] = time.perf_counter() - startTime
-        return allSucceeded, metadata
+        if success and isinstance(download, _ScriptDownload): # Scripts may leave behind partial progress
+            cleanup = self.cleanupManager.releaseScratch(snapshot, self.getFiles())
+            if cleanup:
+                fileMetadata["cleanup"] = cleanup
+
+        return fileMetadata
+
+    def _retrieveConcurrent(self, downloads: list[_URLDownload], overwrite: bool, verbose: bool, workers: int, hostLimit: int) -> list[dict]:
+        hosts = {download.getHost() for download in downloads}
+        hostSemaphores = {host: threading.BoundedSemaphore(hostLimit if hostLimit > 0 else workers) for host in hosts}
+        session = dl.buildSession(workers, len(hosts))
+
+        def retrieveLimited(download: _URLDownload) -> dict:
+            with hostSemaphores[download.getHost()]:
+                return self._retrieve(download, overwrite, False, session)
+
+        Logger.info(f"Downloading {len(downloads)} files with {workers} workers across {len(hosts)} host(s)")
+        if verbose:
+            progress = SteppableProgressBar(len(downloads), processName="Downloading")
+
+        results = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(retrieveLimited, download): idx for idx, download in enumerate(downloads)}
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    fileMetadata = future.result()
+                    results[futures[future]] = fileMetadata
+
+                    if not fileMetadata["success"]:
+                        Logger.warning(f"Failed to download {fileMetadata['output']}")
+
+                    if verbose:
+                        progress.update()
+
+            except KeyboardInterrupt:
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+
+        return [results[idx] for idx in sorted(results)]
 
-    def registerFromURL(self, url: str, fileName: str, fileProperties: dict = {}) -> bool:
-        download = _URLDownload(url, self.downloadDir / fileName, fileProperties, self.username, self.password)
+    def registerFromURL(self, url: str, fileName: str, fileProperties: dict = {}, checksum: dict = {}, refresh: bool = False) -> bool:
+        download = _URLDownload(url, self.downloadDir / fileName, fileProperties, self.username, self.password, checksum, refresh)
+        self.cleanupManager.registerDownload(download.file)
         self.downloads.append(download)
         return True
 
@@ -100,5 +175,6 @@ class DownloadManager:
             Logger.error(f"Invalid download script configuration: {e}")
             return False
         
+        self.cleanupManager.registerDownload(download.file)
         self.downloads.append(download)
         return True
@@ -1,16 +1,21 @@
 from pathlib import Path
 from lib.processing.stages import File
 from lib.processing.scripts import Script
+from lib.systemManagers.cleanup import CleanupManager
 from lib.tools.logger import Logger
 import time
 from datetime import datetime
 
 class _Node:
-    def __init__(self, script: Script, parents: list['_Node']):
+    def __init__(self, script: Script, parents: list['_Node'], cleanupManager: CleanupManager):
         self.script = script
         self.parents = parents
+        self.cleanupManager = cleanupManager
         self.executed = False
 
+        for parent in self.parents:
+            self.cleanupManager.addConsumer(parent.getOutput())
+
     def getOutput(self) -> File:
         return self.script.output
     
@@ -23,25 +28,36 @@ class _Node:
         if self.executed:
             return True, metadata
         
-        parentSuccess = True
-        for parent in self.parents:
-            success, metadata = parent.execute(overwrite, verbose)
-            parentSuccess = parentSuccess and success
-        
-        if not parentSuccess:
-            return False, metadata
+        if overwrite or not self.getOutput().exists(): # Parents only required if output needs to be created
+            parentSuccess = True
+            for parent in self.parents:
+                success, parentMetadata = parent.execute(overwrite, verbose)
+                metadata.extend(parentMetadata)
+                parentSuccess = parentSuccess and success
+            
+            if not parentSuccess:
+                return False, metadata
         
         stattTime = time.perf_counter()
         success = self.script.run(overwrite, verbose)
 
-        metadata.append({
+        stepMetadata = {
             "function": self.getFunction(),
             "output": self.getOutput().filePath.name,
             "success": success,
             "duration": time.perf_counter() - stattTime,
             "timestamp": datetime.now().isoformat()
-        })
+        }
 
+        if success: # Inputs and scratch files are no longer needed by this node
+            cleanup = self.cleanupManager.releaseScratch(self.script.scratch)
+            for parent in self.parents:
+                cleanup.extend(self.cleanupManager.release(parent.getOutput()))
+
+            if cleanup:
+                stepMetadata["cleanup"] = cleanup
+
+        metadata.append(stepMetadata)
         self.executed = success
         return success, metadata
 
@@ -56,9 +72,10 @@ class _Root(_Node):
         return True, []
 
 class ProcessingManager:
-    def __init__(self, baseDir: Path, processingDir: Path):
+    def __init__(self, baseDir: Path, processingDir: Path, cleanupManager: CleanupManager):
         self.baseDir = baseDir
         self.processingDir = processingDir
+        self.cleanupManager = cleanupManager
         self.nodes: list[_Node] = []
 
     def _createNode(self, step: dict, parents: list[_Node]) -> _Node | None:
@@ -69,7 +86,7 @@ class ProcessingManager:
             Logger.error(f"Invalid processing script configuration: {e}")
             return None
         
-        return _Node(script, parents)
+        return _Node(script, parents, self.cleanupManager)
     
     def _addProcessing(self, node: _Node, processingSteps: list[dict]) -> _Node:
         for step in processingSteps:
@@ -88,6 +105,9 @@ class ProcessingManager:
         if not self.processingDir.exists():
             self.processingDir.mkdir()
 
+        for node in self.nodes: # Final outputs are required for conversion
+            self.cleanupManager.protect(node.getOutput())
+
         metadata = {"steps": []}
         allSucceeded = True
 
@@ -65,7 +65,7 @@ class Subfile:
             df.to_csv(newFilePath, sep="\t", index=False)
             
         elif newFileFormat == Format.PARQUET:
-            df.to_parquet(newFilePath, "pyarrow", index=False)
+            df.to_parquet(newFilePath, engine="pyarrow", index=False)
 
         self.remove()
         
@@ -93,7 +93,7 @@ class PARQUETSubfile(Subfile):
     fileFormat = Format.PARQUET
 
     def write(self, df: pd.DataFrame) -> None:
-        df.to_parquet(self.filePath, "pyarrow", index=False)
+        df.to_parquet(self.filePath, engine="pyarrow", index=False)
 
     def read(self, **kwargs) -> pd.DataFrame | None:
         # return pd.read_parquet(self.filePath, "pyarrow", **kwargs)
@@ -140,29 +140,34 @@ class BigFileWriter:
             if not filePath.suffix in Format._value2member_map_.keys():
                 continue
 
-            subFile = Subfile.fromFilePath(filePath)
-            columns = subFile.getColumns()
-            if not columns:
-                filePath.unlink()
+            if not self.addSubfile(filePath):
                 continue
 
-            self.writtenFiles.append(subFile)
-            self.globalColumns = cmn.extendUnique(self.globalColumns, columns)
-
             if logIndividually:
-                Logger.info(f"Added file: {subFile.filePath}")
+                Logger.info(f"Added file: {filePath}")
 
             fileCount += 1
 
         Logger.info(f"Added {fileCount} files to written files list")
 
+    def addSubfile(self, filePath: Path) -> bool:
+        subFile = Subfile.fromFilePath(filePath)
+        columns = subFile.getColumns()
+        if not columns:
+            filePath.unlink()
+            return False
+
+        self.writtenFiles.append(subFile)
+        self.globalColumns = cmn.extendUnique(self.globalColumns, columns)
+        return True
+
     def getSubfileCount(self) -> int:
         return len(self.writtenFiles)
     
     def getSubfileNames(self) -> list[str]:
         return [subfile.fileName for subfile in self.writtenFiles]
 
-    def writeDF(self, df: pd.DataFrame, customName: str = "", format: Format = None) -> None:
+    def writeDF(self, df: pd.DataFrame, customName: str = "", format: Format = None, checkName: bool = True) -> None:
         if not self.subfileDir.exists():
             self.subfileDir.mkdir(parents=True)
 
@@ -173,7 +178,7 @@ class BigFileWriter:
             fileName = customName
             suffix = 0
 
-            while fileName in self.getSubfileNames():
+            while checkName and fileName in self.getSubfileNames(): # Callers with known unique names skip the scan
                 fileName = f"{customName}_{suffix}"
                 suffix += 1
 
@@ -186,6 +191,18 @@ class BigFileWriter:
         self.writtenFiles.append(subfile)
         self.globalColumns = cmn.extendUnique(self.globalColumns, df.columns)
 
+    def writeTable(self, table: pa.Table, customName: str = "") -> None:
+        if not self.subfileDir.exists():
+            self.subfileDir.mkdir(parents=True)
+
+        fileName = customName if customName else f"{self.sectionPrefix}_{len(self.writtenFiles)}"
+
+        subfile = Subfile(self.subfileDir, fileName, Format.PARQUET)
+        pq.write_table(table, subfile.filePath)
+
+        self.writtenFiles.append(subfile)
+        self.globalColumns = cmn.extendUnique(self.globalColumns, table.column_names)
+
     def oneFile(self, removeOld: bool = True) -> None:
         if self.outputFile.exists():
             Logger.info(f"Removing old file {self.outputFile}")
@@ -223,19 +240,34 @@ class BigFileWriter:
             chunkIterator = file.readChunks(chunkSize)
             if chunkIterator is not None:
                 for chunk in chunkIterator:
+                    chunk = chunk.reindex(columns=self.globalColumns) # Align subfiles with differing columns to the header
                     chunk.to_csv(self.outputFile, mode="a", sep=delim, index=False, header=False)
 
             if removeOld:
                 file.remove()
         
     def _oneParquet(self, removeOld: bool = True):
-        schema = pa.schema([(column, pa.string()) for column in self.globalColumns])
+        schema = self._buildSchema()
         with pq.ParquetWriter(self.outputFile, schema=schema) as writer:
             progress = SteppableProgressBar(len(self.writtenFiles), processName="Writing")
             for file in self.writtenFiles:
                 progress.update()
-                
-                writer.write_table(pq.read_table(str(file)))
+
+                table = pq.read_table(str(file))
+                columns = [table[field.name].cast(field.type) if field.name in table.column_names else pa.nulls(len(table), field.type) for field in schema]
+                writer.write_table(pa.Table.from_arrays(columns, schema=schema))
 
                 if removeOld:
                     file.remove()
+
+    def _buildSchema(self) -> pa.Schema:
+        types = {}
+        for file in self.writtenFiles: # Nested columns keep the type declared by their subfiles, everything else is a string
+            if file.filePath.suffix != Format.PARQUET.value:
+                continue
+
+            for field in pq.read_schema(file.filePath):
+                if pa.types.is_nested(field.type):
+                    types.setdefault(field.name, field.type)
+
+        return pa.schema([(column, types.get(column, pa.string())) for column in self.globalColumns])
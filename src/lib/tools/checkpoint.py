@@ -0,0 +1,79 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator
+
+class Checkpoint:
+    _queryLimit = 500 # Keys per IN query, staying under sqlite variable limit
+
+    def __init__(self, dbPath: Path):
+        dbPath.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(dbPath, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS items (key TEXT PRIMARY KEY, done INTEGER, attempts INTEGER, data TEXT)")
+        self._connection.commit()
+
+    def getPending(self, keys: Iterable[str]) -> list[str]:
+        with self._lock:
+            done = {row[0] for row in self._connection.execute("SELECT key FROM items WHERE done = 1")}
+
+        pending = []
+        for key in keys:
+            if key in done:
+                continue
+
+            done.add(key) # Skip duplicate keys
+            pending.append(key)
+
+        return pending
+
+    def isDone(self, key: str) -> bool:
+        with self._lock:
+            return self._connection.execute("SELECT done FROM items WHERE key = ?", (key,)).fetchone() == (1,)
+
+    def markDone(self, items: dict[str, any]) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT INTO items VALUES (?, 1, 1, ?) ON CONFLICT (key) DO UPDATE SET done = 1, attempts = attempts + 1, data = excluded.data",
+                ((key, json.dumps(data)) for key, data in items.items())
+            )
+
+    def markFailed(self, keys: Iterable[str]) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT INTO items VALUES (?, 0, 1, NULL) ON CONFLICT (key) DO UPDATE SET done = 0, attempts = attempts + 1",
+                ((key,) for key in keys)
+            )
+
+    def getMany(self, keys: list[str]) -> dict[str, any]:
+        data = {}
+        with self._lock:
+            for start in range(0, len(keys), self._queryLimit):
+                section = keys[start:start + self._queryLimit]
+                query = f"SELECT key, data FROM items WHERE done = 1 AND key IN ({','.join('?' * len(section))})"
+                data |= {key: json.loads(value) for key, value in self._connection.execute(query, section)}
+
+        return data
+
+    def iterDone(self) -> Iterator[tuple[str, any]]:
+        with self._lock:
+            cursor = self._connection.cursor() # Separate cursor so other calls don't reset iteration
+
+        for key, value in cursor.execute("SELECT key, data FROM items WHERE done = 1 ORDER BY rowid"):
+            yield key, json.loads(value)
+
+    def failedKeys(self) -> list[str]:
+        with self._lock:
+            return [row[0] for row in self._connection.execute("SELECT key FROM items WHERE done = 0")]
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM items")
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -1,135 +1,388 @@
 import re
+import html
+import time
+import asyncio
+import sqlite3
+import hashlib
 import requests
 import urllib.parse
 from requests.auth import HTTPBasicAuth
-from bs4 import BeautifulSoup
 import concurrent.futures
 from pathlib import Path
-import json
+from typing import Iterator
 from lib.tools.logger import Logger
-import lib.commonFuncs as cmn
+import lib.tools.downloading as dl
+
+class _Status:
+    PENDING = "pending"
+    DONE    = "done"
+    ERROR   = "error"
+
+class _CrawlStore:
+    _previous = 0
+    _current = 1
+
+    def __init__(self, dbPath: Path):
+        dbPath.parent.mkdir(parents=True, exist_ok=True)
+
+        self._connection = sqlite3.connect(dbPath)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS frontier (url TEXT PRIMARY KEY, depth INTEGER, status TEXT, attempts INTEGER DEFAULT 0);
+            CREATE INDEX IF NOT EXISTS frontierStatus ON frontier (status);
+            CREATE TABLE IF NOT EXISTS listings (generation INTEGER, url TEXT, hash TEXT, etag TEXT, lastModified TEXT, PRIMARY KEY (generation, url));
+            CREATE TABLE IF NOT EXISTS results (generation INTEGER, parent TEXT, url TEXT, signature TEXT, isFolder INTEGER, PRIMARY KEY (generation, parent, url, isFolder));
+            CREATE INDEX IF NOT EXISTS resultsURL ON results (generation, isFolder, url);
+            CREATE TABLE IF NOT EXISTS changes (url TEXT PRIMARY KEY, change TEXT);
+        """)
+        self._connection.commit()
+
+    def _scalar(self, query: str, params: tuple = ()) -> int:
+        return self._connection.execute(query, params).fetchone()[0]
+
+    def pendingCount(self) -> int:
+        return self._scalar("SELECT COUNT(*) FROM frontier WHERE status = ?", (_Status.PENDING,))
+
+    def hasFrontier(self) -> bool:
+        return self._scalar("SELECT EXISTS (SELECT 1 FROM frontier)") == 1
+
+    def hasPrevious(self) -> bool:
+        return self._scalar("SELECT EXISTS (SELECT 1 FROM listings WHERE generation = ?)", (self._previous,)) == 1
+
+    def reset(self) -> None:
+        with self._connection:
+            if self.hasFrontier() and self.pendingCount() == 0: # Last crawl completed, it becomes the cache for this one
+                for table in ("listings", "results"):
+                    self._connection.execute(f"DELETE FROM {table} WHERE generation = ?", (self._previous,))
+                    self._connection.execute(f"UPDATE {table} SET generation = ? WHERE generation = ?", (self._previous, self._current))
+            else: # Discard partial crawl and keep the last completed one
+                for table in ("listings", "results"):
+                    self._connection.execute(f"DELETE FROM {table} WHERE generation = ?", (self._current,))
+
+            self._connection.execute("DELETE FROM frontier")
+            self._connection.execute("DELETE FROM changes")
+
+    def seed(self, url: str) -> None:
+        with self._connection:
+            self._connection.execute("INSERT OR IGNORE INTO frontier VALUES (?, 0, ?, 0)", (url, _Status.PENDING))
+
+    def iterPending(self) -> Iterator[tuple[str, int, int]]:
+        yield from self._connection.execute("SELECT url, depth, attempts FROM frontier WHERE status = ?", (_Status.PENDING,))
+
+    def enqueue(self, url: str, depth: int) -> bool:
+        if self._scalar("SELECT EXISTS (SELECT 1 FROM listings WHERE generation = ? AND url = ?)", (self._current, url)):
+            return False
+
+        return self._connection.execute("INSERT OR IGNORE INTO frontier VALUES (?, ?, ?, 0)", (url, depth, _Status.PENDING)).rowcount == 1
+
+    def recordAttempt(self, url: str) -> None:
+        with self._connection:
+            self._connection.execute("UPDATE frontier SET attempts = attempts + 1 WHERE url = ?", (url,))
+
+    def getPrevious(self, url: str) -> dict:
+        row = self._connection.execute("SELECT hash, etag, lastModified FROM listings WHERE generation = ? AND url = ?", (self._previous, url)).fetchone()
+        if row is None:
+            return {}
+
+        listing = {key: value for key, value in zip(("hash", "etag", "lastModified"), row) if value is not None}
+        listing["folders"] = self._getEntries(self._previous, url, True)
+        listing["files"] = self._getEntries(self._previous, url, False)
+        return listing
+
+    def _getEntries(self, generation: int, parent: str, isFolder: bool) -> dict[str, str]:
+        return dict(self._connection.execute("SELECT url, signature FROM results WHERE generation = ? AND parent = ? AND isFolder = ?", (generation, parent, isFolder)))
+
+    def complete(self, url: str, listing: dict) -> None:
+        self._connection.execute(
+            "INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?)",
+            (self._current, url, listing.get("hash"), listing.get("etag"), listing.get("lastModified"))
+        )
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+            [(self._current, url, entry, signature, True) for entry, signature in listing["folders"].items()] +
+            [(self._current, url, entry, signature, False) for entry, signature in listing["files"].items()]
+        )
+        self._connection.execute("UPDATE frontier SET status = ? WHERE url = ?", (_Status.DONE, url))
+
+    def fail(self, url: str) -> None:
+        self._connection.execute("UPDATE frontier SET status = ? WHERE url = ?", (_Status.ERROR, url))
+
+    def reuse(self, url: str) -> list[str] | None:
+        if self._scalar("SELECT EXISTS (SELECT 1 FROM listings WHERE generation = ? AND url = ?)", (self._current, url)):
+            return None
+
+        copied = self._connection.execute("INSERT INTO listings SELECT ?, url, hash, etag, lastModified FROM listings WHERE generation = ? AND url = ?", (self._current, self._previous, url)).rowcount
+        if not copied:
+            return None
+
+        self._connection.execute("INSERT OR REPLACE INTO results SELECT ?, parent, url, signature, isFolder FROM results WHERE generation = ? AND parent = ?", (self._current, self._previous, url))
+        return list(self._getEntries(self._current, url, True))
+
+    def commit(self) -> None:
+        self._connection.commit()
+
+    def rollback(self) -> None:
+        self._connection.rollback()
+
+    def iterFiles(self) -> Iterator[str]:
+        for row in self._connection.execute("SELECT DISTINCT url FROM results WHERE generation = ? AND isFolder = 0 ORDER BY url", (self._current,)):
+            yield row[0]
+
+    def writeChanges(self) -> dict[str, int]:
+        with self._connection:
+            self._connection.execute("DELETE FROM changes")
+            self._connection.execute(
+                "INSERT OR IGNORE INTO changes SELECT url, 'added' FROM results c WHERE generation = ? AND isFolder = 0 AND NOT EXISTS (SELECT 1 FROM results p WHERE p.generation = ? AND p.isFolder = 0 AND p.url = c.url)",
+                (self._current, self._previous)
+            )
+            self._connection.execute(
+                "INSERT OR IGNORE INTO changes SELECT url, 'removed' FROM results p WHERE generation = ? AND isFolder = 0 AND NOT EXISTS (SELECT 1 FROM results c WHERE c.generation = ? AND c.isFolder = 0 AND c.url = p.url)",
+                (self._previous, self._current)
+            )
+            self._connection.execute(
+                "INSERT OR IGNORE INTO changes SELECT c.url, 'changed' FROM results c JOIN results p ON p.url = c.url AND p.isFolder = 0 AND p.generation = ? WHERE c.generation = ? AND c.isFolder = 0 AND c.signature != p.signature",
+                (self._previous, self._current)
+            )
+
+        return dict(self._connection.execute("SELECT change, COUNT(*) FROM changes GROUP BY change"))
+
+    def getChanges(self) -> dict[str, list[str]]:
+        changes = {"added": [], "removed": [], "changed": []}
+        for url, change in self._connection.execute("SELECT url, change FROM changes ORDER BY url"):
+            changes[change].append(url)
+
+        return changes
+
+    def close(self) -> None:
+        self._connection.close()
 
 class Crawler:
-    def __init__(self, workingDir: Path, reString: str, downloadLink: str = "", maxDepth: int = -1, maxWorkers: int = 200, retries: int = 5, user: str = "", password: str = ""):
+    _anchorRegex = re.compile(r"<a\s[^>]*?href\s*=\s*[\"']?([^\"' >]+)[^>]*>.*?</a>", re.IGNORECASE | re.DOTALL)
+    _tagRegex = re.compile(r"<[^>]*>")
+
+    def __init__(self, workingDir: Path, reString: str, downloadLink: str = "", maxDepth: int = -1, maxWorkers: int = 64, retries: int = 5, user: str = "", password: str = "", hostLimit: int = 16, hostDelay: float = 0, timeout: float = 30):
         self.workingDir = workingDir
         self.reString = reString
         self.downloadLink = downloadLink
         self.maxDepth = maxDepth
         self.maxWorkers = maxWorkers
         self.retries = retries
+        self.hostLimit = hostLimit
+        self.hostDelay = hostDelay
+        self.timeout = timeout
 
         self.subdir = self.workingDir / "crawlerProgress"
+        self.store = _CrawlStore(self.subdir / "crawler.sqlite")
 
         self.regex = re.compile(reString)
         self.auth = HTTPBasicAuth(user, password) if user else None
+        self.session = dl.buildSession(maxWorkers)
 
     def crawl(self, url: str, ignoreProgress: bool = False) -> None:
         if ignoreProgress:
             self._clearProgress()
 
-        folderURLs, subDirDepth = self._loadProgress() # Load urls from progress
-
-        if subDirDepth < 0: # No previous crawler progress
-            folderURLs.append(url)
-            subDirDepth = 0
-        elif not folderURLs: # Found progress but no more folders left to search
+        if not self.store.hasFrontier(): # No previous crawler progress
+            self.store.seed(url)
+        elif not self.store.pendingCount(): # Found progress but no more folders left to search
             Logger.info("Nothing left to crawl, exiting...")
             return
-        
-        Logger.info("Crawling...")
-        while len(folderURLs):
-            newFolders = []
-            errorFolders = []
-            matchingFiles = []
-
-            with concurrent.futures.ThreadPoolExecutor(max_workers=self.maxWorkers) as executor:
-                futures = [executor.submit(self.getMatches, folderURL) for folderURL in folderURLs]
-                totalFolders = len(folderURLs)
+
+        Logger.info("Crawling with cached listings..." if self.store.hasPrevious() else "Crawling...")
+        try:
+            asyncio.run(self._crawl())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.store.commit()
+            print()
+
+        if not self.store.pendingCount() and self.store.hasPrevious(): # Crawl completed, compare against cached listings
+            counts = self.store.writeChanges()
+            Logger.info(f"Crawl found {counts.get('added', 0)} added, {counts.get('removed', 0)} removed and {counts.get('changed', 0)} changed files")
+
+    async def _crawl(self) -> None:
+        loop = asyncio.get_running_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.maxWorkers)
+        loop.set_default_executor(executor)
+
+        queue: asyncio.Queue[tuple[str, int, int]] = asyncio.Queue()
+        for entry in self.store.iterPending():
+            queue.put_nowait(entry)
+
+        hostLimits: dict[str, asyncio.Semaphore] = {}
+        hostLastRequest: dict[str, float] = {}
+        completed = 0
+        reused = 0
+
+        async def politeFetch(folderURL: str, previous: dict) -> dict | None:
+            host = urllib.parse.urlparse(folderURL).netloc
+            if host not in hostLimits:
+                hostLimits[host] = asyncio.Semaphore(self.hostLimit)
+
+            async with hostLimits[host]:
+                if self.hostDelay > 0: # Space out requests to the same host
+                    wait = hostLastRequest.get(host, 0) + self.hostDelay - time.perf_counter()
+                    hostLastRequest[host] = time.perf_counter() + max(wait, 0)
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+
+                return await loop.run_in_executor(None, self.getListing, folderURL, previous)
+
+        def canDescend(depth: int) -> bool:
+            return depth < self.maxDepth or self.maxDepth < 0
+
+        def reuseSubtree(folderURL: str, depth: int) -> None: # Copy unchanged listings from cache without requesting them
+            nonlocal reused
+
+            stack = [(folderURL, depth)]
+            while stack:
+                url, urlDepth = stack.pop()
+                subFolders = self.store.reuse(url)
+                if subFolders is None:
+                    continue
+
+                reused += 1
+                if canDescend(urlDepth):
+                    stack.extend((subFolder, urlDepth + 1) for subFolder in subFolders)
+
+        async def crawlFolder(folderURL: str, depth: int, attempts: int) -> None:
+            nonlocal completed
+
+            previous = self.store.getPrevious(folderURL)
+
+            failed = False
+            while True:
                 try:
-                    for idx, future in enumerate(concurrent.futures.as_completed(futures), start=1):
-                        print(f"At depth: {subDirDepth}, folder: {idx} / {totalFolders}", end="\r")
-                        try:
-                            success, usedFolderURL, newSubFolders, newFiles = future.result(timeout=10)
-                        except concurrent.futures.TimeoutError:
-                            errorFolders.append(usedFolderURL)
-                            continue
+                    listing = await politeFetch(folderURL, previous)
+                    break
+                except (requests.exceptions.RequestException, ConnectionError) as e:
+                    attempts += 1
+                    self.store.recordAttempt(folderURL)
+
+                    clientError = isinstance(e, requests.exceptions.HTTPError) and e.response is not None and e.response.status_code < 500
+                    if clientError or attempts >= self.retries: # Client errors won't resolve by retrying
+                        failed = True
+                        break
+
+                    await asyncio.sleep(2 ** attempts)
+
+            if failed: # Keep cached listing so a transient failure isn't reported as removed files
+                self.store.fail(folderURL)
+                reuseSubtree(folderURL, depth)
 
-                        if not success:
-                            errorFolders.append(usedFolderURL)
+            else:
+                if listing is None: # Listing unchanged since last crawl, subfolders with unchanged rows are reused below
+                    listing = previous
+
+                self.store.complete(folderURL, listing)
+                previousFolders = previous.get("folders", {})
+
+                if canDescend(depth): # Queue subfolders immediately instead of waiting for depth to finish
+                    for subFolder, signature in listing["folders"].items():
+                        if signature and previousFolders.get(subFolder) == signature: # Row date/size unchanged, reuse cached subtree
+                            reuseSubtree(subFolder, depth + 1)
                             continue
-                        
-                        folderURLs.remove(usedFolderURL)
-                        matchingFiles.extend(newFiles)
 
-                        if subDirDepth < self.maxDepth or self.maxDepth < 0:
-                            newFolders.extend(newSubFolders)
+                        if self.store.enqueue(subFolder, depth + 1):
+                            queue.put_nowait((subFolder, depth + 1, 0))
 
-                except KeyboardInterrupt:
-                    return
+            self.store.commit() # Folder results and frontier update land together for exact resume
+            completed += 1
+            print(f"Crawled folders: {completed} | Reused: {reused} | Queued: {queue.qsize()}", end="\r")
 
-            folderURLs = newFolders.copy()
-            subDirDepth += 1
-            self.writeProgress(subDirDepth, folderURLs, matchingFiles, errorFolders)
-            print()
+        async def worker() -> None:
+            while True:
+                folderURL, depth, attempts = await queue.get()
+
+                try:
+                    await crawlFolder(folderURL, depth, attempts)
+                except Exception as e: # Unexpected errors fail the folder instead of killing the worker and stalling the queue
+                    Logger.warning(f"Failed to crawl {folderURL}: {e!r}")
+                    try:
+                        self.store.rollback() # Writes are committed per folder, so only this folder's partial results are discarded
+                        self.store.fail(folderURL)
+                        reuseSubtree(folderURL, depth)
+                        self.store.commit()
+                    except sqlite3.Error as storeError:
+                        Logger.error(f"Unable to record failure for {folderURL}: {storeError}")
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.maxWorkers)]
+        try:
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+
+            await asyncio.gather(*workers, return_exceptions=True)
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def iterURLs(self) -> Iterator[str]:
+        yield from self.store.iterFiles()
 
     def getURLList(self) -> list[str]:
-        matches = []
-        for idx, file in enumerate(self.subdir.iterdir()):
-            print(f"Collecting url from file: {idx}", end="\r")
-            with open(file) as fp:
-                data = json.load(fp)
-
-            matches.extend(data.get("Files", []))
-        print()
-        return matches
-                
-    def getMatches(self, location: str) -> tuple[bool, str, list[str], list[str]]:
-        for attempt in range(self.retries):
-            try:
-                rawHTML = requests.get(location, auth=self.auth)
-                break
-            except (ConnectionError, requests.exceptions.ConnectionError):
-                if attempt == self.retries:
-                    return (False, location, [], [])
-
-        soup = BeautifulSoup(rawHTML.text, 'html.parser')
-
-        folders = []
-        matches = []
-        for link in soup.find_all('a'):
-            link = link.get('href')
-
-            if link is None:
-                continue
-            
+        return list(self.iterURLs())
+
+    def getChanges(self) -> dict[str, list[str]]:
+        return self.store.getChanges()
+
+    def pendingCount(self) -> int:
+        return self.store.pendingCount()
+
+    def getListing(self, location: str, cached: dict) -> dict | None:
+        headers = {}
+        if "etag" in cached:
+            headers["If-None-Match"] = cached["etag"]
+        if "lastModified" in cached:
+            headers["If-Modified-Since"] = cached["lastModified"]
+
+        response = self.session.get(location, auth=self.auth, timeout=self.timeout, headers=headers)
+        if response.status_code == 304:
+            return None
+
+        response.raise_for_status()
+
+        listingHash = hashlib.sha256(response.content).hexdigest()
+        if cached.get("hash") == listingHash:
+            return None
+
+        folders, matches = self.getMatches(location, response.text)
+        listing = {"hash": listingHash, "folders": folders, "files": matches}
+        if "ETag" in response.headers:
+            listing["etag"] = response.headers["ETag"]
+        if "Last-Modified" in response.headers:
+            listing["lastModified"] = response.headers["Last-Modified"]
+
+        return listing
+
+    def getMatches(self, location: str, text: str) -> tuple[dict[str, str], dict[str, str]]:
+        folders = {}
+        matches = {}
+
+        anchors = list(self._anchorRegex.finditer(text))
+        for idx, anchor in enumerate(anchors):
+            link = html.unescape(anchor.group(1))
+
+            # Text following the link on the same row holds the listed date and size, used as a change signature
+            rowEnd = anchors[idx + 1].start() if idx + 1 < len(anchors) else len(text)
+            lineEnd = text.find("\n", anchor.end(), rowEnd)
+            rowText = text[anchor.end():rowEnd if lineEnd < 0 else lineEnd]
+            signature = " ".join(self._tagRegex.sub(" ", rowText).split())
+
             fullLink = urllib.parse.urljoin(location, link)
             if fullLink.startswith(location) and fullLink != location and fullLink.endswith('/'): # Folder classification
-                folders.append(fullLink)
+                folders[fullLink] = signature
 
             if self.regex.match(link):
                 if self.downloadLink:
-                    matches.append(urllib.parse.urljoin(self.downloadLink, link))
+                    matches[urllib.parse.urljoin(self.downloadLink, link)] = signature
                 else:
-                    matches.append(fullLink)
-
-        return (True, location, folders, matches)
-    
-    def writeProgress(self, depth: int, foundFolders: list, foundFiles: list, errorFolders: list):
-        self.subdir.mkdir(parents=True, exist_ok=True)
-
-        with open(self.subdir / f"crawler_depth_{depth}.json", "w") as fp:
-            json.dump({"Folders": foundFolders, "Files": foundFiles, "Error Folders": errorFolders}, fp, indent=4)
-
-    def _loadProgress(self) -> tuple[list[Path], int]:
-        files = list(self.subdir.glob("crawler_depth_*.json"))
-        sortedFiles = sorted(files, key=lambda x: int(x.stem.split("_")[-1]), reverse=True)
-        for file in sortedFiles:
-            with open(file) as fp:
-                data = json.load(fp)
+                    matches[fullLink] = signature
 
-            if "Folders" in data:
-                return (data["Folders"], len(files))
-        return ([], -1)
+        return folders, matches
 
     def _clearProgress(self) -> None:
-        cmn.clearFolder(self.subdir, True)
+        self.store.reset()
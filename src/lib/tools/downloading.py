@@ -1,62 +1,224 @@
 import requests
+import hashlib
+import json
+import time
+import re
 from pathlib import Path
 from requests.auth import HTTPBasicAuth
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError
 from lib.tools.logger import Logger
 from lib.tools.progressBar import ProgressBar
 
 class RepeatDownloader:
-    def __init__(self, headers: dict = {}, username: str = "", password: str = "", chunkSize: int = 1024*1024, verbose: bool = False):
+    def __init__(self, headers: dict = {}, username: str = "", password: str = "", chunkSize: int = 1024*1024, verbose: bool = False, poolSize: int = 10):
         self.headers = headers
         self.auth = buildAuth(username, password) if username else None
         self.chunkSize = chunkSize
         self.verbose = verbose
+        self.session = buildSession(poolSize)
 
-    def download(self, url: str, filePath: Path, customChunkSize: int = -1, additionalHeaders: dict = {}) -> bool:
+    def download(self, url: str, filePath: Path, customChunkSize: int = -1, additionalHeaders: dict = {}, checksum: dict = {}) -> bool:
         chunkSize = customChunkSize if customChunkSize >= 0 else self.chunkSize
-        return download(url, filePath, chunkSize, self.verbose, self.headers | additionalHeaders, self.auth)
+        return download(url, filePath, chunkSize, self.verbose, self.headers | additionalHeaders, self.auth, self.session, checksum=checksum)
 
 def buildAuth(username: str, password: str) -> HTTPBasicAuth:
     return HTTPBasicAuth(username, password)
 
-def download(url: str, filePath: Path, chunkSize: int = 1024*1024, verbose: bool = False, headers: dict = {}, auth: HTTPBasicAuth = None) -> bool:
+def buildSession(poolSize: int = 10, hostCount: int = 10) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max(hostCount, 1), pool_maxsize=max(poolSize, 1))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def getInfoPath(filePath: Path) -> Path:
+    return filePath.parent / f".{filePath.name}.json"
+
+def getPartialPath(filePath: Path) -> Path:
+    return filePath.parent / f"{filePath.name}.part"
+
+def loadInfo(filePath: Path) -> dict:
+    infoPath = getInfoPath(filePath)
+    if not infoPath.exists():
+        return {}
+
+    try:
+        with open(infoPath) as fp:
+            return json.load(fp)
+    except json.JSONDecodeError:
+        return {}
+
+def _saveInfo(filePath: Path, info: dict) -> None:
+    with open(getInfoPath(filePath), "w") as fp:
+        json.dump(info, fp, indent=4)
+
+def _hashFile(filePath: Path, hasher: "hashlib._Hash", chunkSize: int) -> None:
+    with open(filePath, "rb") as fp:
+        while chunk := fp.read(chunkSize):
+            hasher.update(chunk)
+
+def getExpectedDigest(checksum: dict, url: str, algorithm: str, session: requests.Session, auth: HTTPBasicAuth = None) -> str:
+    digest = checksum.get("digest", "")
+    if digest:
+        return digest.lower()
+
+    checksumURL = checksum.get("url", "")
+    if not checksumURL and "suffix" in checksum:
+        checksumURL = url + checksum["suffix"]
+
+    if not checksumURL:
+        return ""
+
+    try:
+        response = session.get(checksumURL, auth=auth)
+        response.raise_for_status()
+    except (requests.exceptions.RequestException, HTTPError) as e:
+        Logger.warning(f"Unable to retrieve checksum from {checksumURL}: {e}")
+        return ""
+
+    digestLength = hashlib.new(algorithm).digest_size * 2
+    match = re.search(rf"\b[0-9a-fA-F]{{{digestLength}}}\b", response.text) # Handles both `md5sum` and BSD style checksum files
+    if match is None:
+        Logger.warning(f"No {algorithm} digest found in checksum file {checksumURL}")
+        return ""
+
+    return match.group().lower()
+
+def download(url: str, filePath: Path, chunkSize: int = 1024*1024, verbose: bool = False, headers: dict = {}, auth: HTTPBasicAuth = None, session: requests.Session = None, retries: int = 5, checksum: dict = {}, overwrite: bool = False) -> bool:
     if chunkSize <= 0:
         Logger.error(f"Invalid chunk size `{chunkSize}`, value must be greater than 0")
         return False
+
+    algorithm = checksum.get("algorithm", "md5").lower()
+    if algorithm not in hashlib.algorithms_available:
+        Logger.error(f"Unknown checksum algorithm `{algorithm}`")
+        return False
     
     if verbose:
         Logger.info(f"Downloading from {url} to file {filePath.absolute()}")
-        progressBar = ProgressBar(processName="Downloading")
-        
 
-    try:
-        requests.head(url, auth=auth, headers=headers)
-    except requests.exceptions.InvalidSchema as e:
-        Logger.error(f"Schema error: {e}")
-        return False
+    if session is None:
+        session = requests
+
+    partialPath = getPartialPath(filePath)
+    info = loadInfo(filePath)
+    if info.get("url", url) != url: # Stored validators belong to a different remote file
+        info = {}
+
+    if overwrite: # Forced download, no resume or conditional request so the server always sends the full file
+        info = {}
+        partialPath.unlink(missing_ok=True)
+
+    for attempt in range(1, retries + 1):
+        requestHeaders = dict(headers)
+        validator = info.get("etag", info.get("lastModified", ""))
+        startByte = partialPath.stat().st_size if partialPath.exists() else 0
+
+        if startByte > 0: # Resume from partial download
+            requestHeaders["Range"] = f"bytes={startByte}-"
+            requestHeaders["Accept-Encoding"] = "identity" # Byte offsets must match the stored file
+            if validator: # Server sends the full file instead if it has changed since partial download
+                requestHeaders["If-Range"] = validator
+
+        elif filePath.exists(): # Only download again if remote file has changed
+            if "etag" in info:
+                requestHeaders["If-None-Match"] = info["etag"]
+            if "lastModified" in info:
+                requestHeaders["If-Modified-Since"] = info["lastModified"]
 
-    with requests.get(url, stream=True, auth=auth, headers=headers) as stream:
         try:
-            stream.raise_for_status()
-        except HTTPError:
-            Logger.error("Received HTTP error")
-            return False
-        
-        fileSize = int(stream.headers.get("Content-Length", 0))
+            with session.get(url, stream=True, auth=auth, headers=requestHeaders) as stream:
+                if stream.status_code == 304:
+                    Logger.info(f"Remote file unchanged since last download, keeping {filePath.name}")
+                    return True
 
-        with open(filePath, "wb") as fp:
-            for idx, chunk in enumerate(stream.iter_content(chunkSize), start=1):
-                fp.write(chunk)
+                hasher = hashlib.new(algorithm)
+                if stream.status_code == 416 and startByte > 0: # Range not satisfiable, partial file may already be complete
+                    totalSize = stream.headers.get("Content-Range", "").rsplit("/", 1)[-1]
+                    if totalSize.isdigit() and int(totalSize) == startByte:
+                        _hashFile(partialPath, hasher, chunkSize)
+                        break
 
-                if not verbose:
+                    partialPath.unlink()
                     continue
-                
-                if fileSize > 0: # File size known, can render completion %
-                    progressBar.update((idx * chunkSize) / fileSize)
-                else:
-                    print(f"Downloaded chunk: {idx}", end="\r")
+
+                try:
+                    stream.raise_for_status()
+                except HTTPError:
+                    Logger.error(f"Received HTTP error {stream.status_code}")
+                    return False
+
+                if stream.status_code != 206: # Full content returned, start from beginning
+                    startByte = 0
+                else: # Digest must include previously downloaded bytes
+                    _hashFile(partialPath, hasher, chunkSize)
+
+                info = {"url": url}
+                if "ETag" in stream.headers:
+                    info["etag"] = stream.headers["ETag"]
+                if "Last-Modified" in stream.headers:
+                    info["lastModified"] = stream.headers["Last-Modified"]
+                _saveInfo(filePath, info)
+
+                fileSize = int(stream.headers.get("Content-Length", 0)) + startByte
+                progressBar = ProgressBar(processName="Downloading") if verbose else None
+                _writeStream(stream, partialPath, startByte, fileSize, chunkSize, progressBar, hasher)
+
+            break
+
+        except requests.exceptions.InvalidSchema as e:
+            Logger.error(f"Schema error: {e}")
+            return False
+
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.exceptions.Timeout) as e:
+            if verbose:
+                print()
+
+            Logger.warning(f"Download of {filePath.name} interrupted ({attempt}/{retries}): {e}")
+            if attempt == retries:
+                return False
+
+            time.sleep(2 ** attempt)
+    else:
+        return False
 
     if verbose:                
         print()
 
+    downloadedSize = partialPath.stat().st_size
+    digest = hasher.hexdigest()
+
+    expectedSize = checksum.get("size", 0)
+    if expectedSize and downloadedSize != expectedSize:
+        Logger.error(f"Downloaded file {filePath.name} is {downloadedSize} bytes but expected {expectedSize}, removing")
+        partialPath.unlink()
+        return False
+
+    expectedDigest = getExpectedDigest(checksum, url, algorithm, session, auth)
+    if expectedDigest and digest != expectedDigest:
+        Logger.error(f"Downloaded file {filePath.name} has {algorithm} digest {digest} but expected {expectedDigest}, removing")
+        partialPath.unlink()
+        return False
+
+    partialPath.replace(filePath)
+    info["size"] = downloadedSize
+    info[algorithm] = digest
+    info["verified"] = bool(expectedDigest or expectedSize)
+    _saveInfo(filePath, info)
+
     return True
+
+def _writeStream(stream: requests.Response, outputPath: Path, startByte: int, fileSize: int, chunkSize: int, progressBar: ProgressBar | None, hasher: "hashlib._Hash") -> None:
+    with open(outputPath, "ab" if startByte > 0 else "wb") as fp:
+        for idx, chunk in enumerate(stream.iter_content(chunkSize), start=1):
+            fp.write(chunk)
+            hasher.update(chunk)
+
+            if progressBar is None:
+                continue
+            
+            if fileSize > 0: # File size known, can render completion %
+                progressBar.update((startByte + idx * chunkSize) / fileSize)
+            else:
+                print(f"Downloaded chunk: {idx}", end="\r")
@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import requests
+import lib.config as cfg
+from enum import Enum
+from pathlib import Path
+from requests.structures import CaseInsensitiveDict
+from lib.tools.logger import Logger
+
+class CacheMode(Enum):
+    OFF    = "off"    # Always request, never store
+    CACHE  = "cache"  # Use stored responses younger than the ttl, otherwise request and store
+    RECORD = "record" # Always request and store, replacing stored responses
+    REPLAY = "replay" # Only use stored responses, never touching the network
+
+class CacheMiss(requests.exceptions.RequestException):
+    pass
+
+class _ResponseStore:
+    def __init__(self, dbPath: Path):
+        dbPath.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(dbPath, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, method TEXT, url TEXT, status INTEGER, reason TEXT, headers TEXT, content BLOB, encoding TEXT, created REAL)")
+        self._connection.commit()
+
+    def get(self, key: str) -> tuple | None:
+        with self._lock:
+            return self._connection.execute("SELECT method, url, status, reason, headers, content, encoding, created FROM responses WHERE key = ?", (key,)).fetchone()
+
+    def put(self, key: str, method: str, url: str, response: requests.Response) -> None:
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, method, url, response.status_code, response.reason, json.dumps(dict(response.headers)), response.content, response.encoding, time.time())
+            )
+            self._connection.commit()
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._connection.commit()
+
+class CachedSession(requests.Session):
+    _stores: dict[Path, _ResponseStore] = {}
+    _storeLock = threading.Lock()
+    _unkeyedHeaders = {"user-agent", "connection", "content-length", "accept-encoding"} # Don't change the decoded content
+
+    def __init__(self, namespace: str = "default", ttl: float = None, mode: CacheMode = None, cacheDir: Path = None, shouldCache: callable = None):
+        super().__init__()
+
+        self.shouldCache = shouldCache if shouldCache is not None else (lambda response: response.ok)
+
+        self.ttl = ttl if ttl is not None else float(os.environ.get("ARGA_HTTP_CACHE_TTL", 24 * 60 * 60))
+        self.mode = mode if mode is not None else CacheMode(os.environ.get("ARGA_HTTP_CACHE", CacheMode.OFF.value))
+
+        cacheDir = cacheDir if cacheDir is not None else cfg.Folders.cache
+        self.storePath = cacheDir / f"{namespace}.sqlite"
+        self._store: _ResponseStore = None
+
+    @property
+    def store(self) -> _ResponseStore:
+        if self._store is None: # Opened on first use so sessions with caching off never create a cache file
+            self._store = self._getStore(self.storePath)
+
+        return self._store
+
+    @classmethod
+    def _getStore(cls, dbPath: Path) -> _ResponseStore:
+        with cls._storeLock: # Sessions sharing a namespace share one connection
+            if dbPath not in cls._stores:
+                cls._stores[dbPath] = _ResponseStore(dbPath)
+
+            return cls._stores[dbPath]
+
+    def _buildKey(self, request: requests.PreparedRequest) -> str:
+        body = request.body or b""
+        if isinstance(body, str):
+            body = body.encode()
+
+        # Auth, api key and accept headers change the response, so requests differing in them are stored separately
+        headers = sorted((key.lower(), value) for key, value in request.headers.items() if key.lower() not in self._unkeyedHeaders)
+        headerText = "\n".join(f"{key}: {value}" for key, value in headers)
+
+        return hashlib.sha256(request.method.encode() + b" " + request.url.encode() + b"\n" + headerText.encode() + b"\n" + body).hexdigest()
+
+    def _buildResponse(self, request: requests.PreparedRequest, row: tuple) -> requests.Response:
+        _, url, status, reason, headers, content, encoding, _ = row
+
+        response = requests.Response()
+        response.request = request
+        response.url = url
+        response.status_code = status
+        response.reason = reason
+        response.headers = CaseInsensitiveDict(json.loads(headers))
+        response.headers.pop("Content-Encoding", None) # Stored content is already decoded
+        response._content = content
+        response._content_consumed = True
+        response.encoding = encoding
+        return response
+
+    def send(self, request: requests.PreparedRequest, **kwargs: dict) -> requests.Response:
+        if self.mode == CacheMode.OFF or kwargs.get("stream", False): # Streamed bodies are never cached
+            return super().send(request, **kwargs)
+
+        key = self._buildKey(request)
+
+        if self.mode in (CacheMode.CACHE, CacheMode.REPLAY):
+            row = self.store.get(key)
+            if row is not None and (self.mode == CacheMode.REPLAY or time.time() - row[-1] <= self.ttl):
+                return self._buildResponse(request, row)
+
+            if self.mode == CacheMode.REPLAY:
+                raise CacheMiss(f"No recorded response for {request.method} {request.url}", request=request)
+
+        response = super().send(request, **kwargs)
+        if self.shouldCache(response):
+            self.store.put(key, request.method, request.url, response)
+
+        return response
+
+    def invalidate(self, method: str, url: str, **kwargs: dict) -> None:
+        if self._store is None and not self.storePath.exists(): # Nothing has been stored to invalidate
+            return
+
+        request = self.prepare_request(requests.Request(method, url, **kwargs))
+        self.store.remove(self._buildKey(request))
+
+_defaultSession: CachedSession = None
+_defaultLock = threading.Lock()
+
+def getSession() -> CachedSession:
+    global _defaultSession
+
+    with _defaultLock:
+        if _defaultSession is None:
+            _defaultSession = CachedSession()
+            Logger.debug(f"Created shared http session with cache mode '{_defaultSession.mode.value}'")
+
+        return _defaultSession
+
+def get(url: str, **kwargs: dict) -> requests.Response:
+    return getSession().get(url, **kwargs)
+
+def post(url: str, **kwargs: dict) -> requests.Response:
+    return getSession().post(url, **kwargs)
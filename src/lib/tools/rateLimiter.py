@@ -0,0 +1,35 @@
+import time
+import asyncio
+import threading
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+
+        self._tokens = capacity
+        self._lastRefill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._lastRefill) * self.rate)
+        self._lastRefill = now
+
+    def _reserve(self, tokens: float) -> float:
+        with self._lock:
+            self._refill()
+            self._tokens -= tokens # Going negative queues callers behind each other, keeping them in order
+
+            return max(0, -self._tokens / self.rate)
+
+    def acquire(self, tokens: float = 1) -> None:
+        time.sleep(self._reserve(tokens))
+
+    async def acquireAsync(self, tokens: float = 1) -> None:
+        await asyncio.sleep(self._reserve(tokens))
+
+    def penalise(self, seconds: float) -> None:
+        with self._lock: # Pushes every waiting caller back, such as when a server asks to slow down
+            self._refill()
+            self._tokens -= seconds * self.rate
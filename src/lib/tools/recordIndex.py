@@ -0,0 +1,182 @@
+import re
+import sqlite3
+from pathlib import Path
+from typing import Iterator
+from lxml import etree
+from lib.tools.logger import Logger
+import lib.tools.zipping as zp
+
+class RecordIndex:
+    _chunkSize = 16 * 1024 * 1024
+    _keyWindow = 64 * 1024 # Bytes after a record start searched for its key
+    _insertBatch = 100000
+    _queryLimit = 500
+
+    def __init__(self, filePath: Path, startPattern: bytes, keyPattern: bytes = b"", hasFooter: bool = False):
+        # Byte offsets need a seekable file, compressed sources are indexed through a kept decompressed copy
+        self.sourcePath = filePath
+        self.filePath = zp.decompressedCopy(filePath) if zp.canBeExtracted(filePath) else filePath
+        self.indexPath = filePath.parent / f".{filePath.name}.index.sqlite"
+
+        self._startPattern = re.compile(startPattern)
+        self._keyPattern = re.compile(keyPattern) if keyPattern else None
+        self._hasFooter = hasFooter
+
+        self._connection = sqlite3.connect(self.indexPath)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS records (idx INTEGER PRIMARY KEY, key TEXT, offset INTEGER, length INTEGER)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS recordKeys ON records (key)")
+        self._connection.commit()
+
+        if not self._isCurrent():
+            self.build()
+
+        self.header = self._getMeta("header") or b""
+        self.footer = self._getMeta("footer") or b""
+
+    @classmethod
+    def forXML(cls, filePath: Path, recordTag: str = "", keyAttribute: str = "accession") -> 'RecordIndex':
+        if not recordTag:
+            recordTag = findXMLRecordTag(filePath)
+
+        localTag = recordTag.rsplit("}", 1)[-1] # Namespaced tags are written with an optional prefix in the file
+        startPattern = rb"<(?:[\w.-]+:)?" + re.escape(localTag.encode()) + rb"[\s/>]"
+        keyPattern = rb"[^>]*?\s" + re.escape(keyAttribute.encode()) + rb"\s*=\s*[\"']([^\"']*)" if keyAttribute else b""
+        return cls(filePath, startPattern, keyPattern, True)
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def _getMeta(self, key: str) -> any:
+        row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _fileSignature(self) -> str:
+        stat = self.filePath.stat()
+        return f"{stat.st_size}:{stat.st_mtime_ns}:{self._startPattern.pattern!r}:{self._keyPattern.pattern if self._keyPattern else b''!r}"
+
+    def _isCurrent(self) -> bool:
+        return self._getMeta("signature") == self._fileSignature()
+
+    def build(self) -> None:
+        Logger.info(f"Building record index for {self.filePath.name}")
+        fileSize = self.filePath.stat().st_size
+
+        with self._connection:
+            self._connection.execute("DELETE FROM records")
+            self._connection.execute("DELETE FROM meta")
+
+        footerStart = fileSize
+        with open(self.filePath, "rb") as fp:
+            if self._hasFooter: # Closing root tag is excluded from the final record
+                fp.seek(max(0, fileSize - self._chunkSize))
+                tail = fp.read()
+                footerStart = fileSize - len(tail) + max(tail.rfind(b"</"), 0)
+
+            fp.seek(0)
+            entries = []
+            recordCount = 0
+            previous = None
+            for offset, key in self._scan(fp, footerStart):
+                if previous is not None:
+                    entries.append((recordCount, previous[1], previous[0], offset - previous[0]))
+                    recordCount += 1
+
+                previous = (offset, key)
+
+                if len(entries) >= self._insertBatch:
+                    self._insert(entries)
+                    entries.clear()
+
+            if previous is not None:
+                entries.append((recordCount, previous[1], previous[0], footerStart - previous[0]))
+                recordCount += 1
+
+            self._insert(entries)
+
+            firstOffset = self._connection.execute("SELECT offset FROM records WHERE idx = 0").fetchone()
+            fp.seek(0)
+            header = fp.read(firstOffset[0]) if firstOffset is not None else b""
+            fp.seek(footerStart)
+            footer = fp.read()
+
+        with self._connection:
+            self._connection.executemany("INSERT INTO meta VALUES (?, ?)", [("header", header), ("footer", footer), ("signature", self._fileSignature())])
+
+        Logger.info(f"Indexed {recordCount:,} records in {self.filePath.name}")
+
+    def _scan(self, fp, endPosition: int) -> Iterator[tuple[int, str]]:
+        base = 0
+        buffer = b""
+
+        while True:
+            chunk = fp.read(self._chunkSize)
+            buffer += chunk
+
+            limit = len(buffer) if not chunk else max(len(buffer) - self._keyWindow, 0) # Matches near the end wait for the next chunk
+            for match in self._startPattern.finditer(buffer):
+                if match.start() >= limit:
+                    break
+
+                offset = base + match.start()
+                if offset >= endPosition:
+                    return
+
+                key = None
+                if self._keyPattern is not None:
+                    keyMatch = self._keyPattern.match(buffer, match.start(), match.start() + self._keyWindow)
+                    if keyMatch is not None:
+                        key = keyMatch.group(1).decode(errors="replace")
+
+                yield offset, key
+
+            if not chunk:
+                return
+
+            buffer = buffer[limit:]
+            base += limit
+
+    def _insert(self, entries: list[tuple]) -> None:
+        with self._connection:
+            self._connection.executemany("INSERT INTO records VALUES (?, ?, ?, ?)", entries)
+
+    def getRange(self, firstEntry: int, entryCount: int = 0) -> list[tuple[int, int]]:
+        if entryCount > 0:
+            rows = self._connection.execute("SELECT offset, length FROM records WHERE idx >= ? AND idx < ? ORDER BY idx", (firstEntry, firstEntry + entryCount))
+        else:
+            rows = self._connection.execute("SELECT offset, length FROM records WHERE idx >= ? ORDER BY idx", (firstEntry,))
+
+        return rows.fetchall()
+
+    def getSpan(self, firstEntry: int, entryCount: int = 0) -> tuple[int, int] | None:
+        records = self._connection.execute("SELECT MIN(offset), MAX(offset + length) FROM records WHERE idx >= ? AND (? <= 0 OR idx < ?)", (firstEntry, entryCount, firstEntry + entryCount)).fetchone()
+        return records if records[0] is not None else None
+
+    def lookup(self, keys: list[str]) -> dict[str, tuple[int, int]]:
+        found = {}
+        for start in range(0, len(keys), self._queryLimit):
+            section = keys[start:start + self._queryLimit]
+            query = f"SELECT key, offset, length FROM records WHERE key IN ({','.join('?' * len(section))})"
+            found |= {key: (offset, length) for key, offset, length in self._connection.execute(query, section)}
+
+        return found
+
+    def read(self, locations: list[tuple[int, int]]) -> Iterator[bytes]:
+        with open(self.filePath, "rb") as fp:
+            for offset, length in locations:
+                fp.seek(offset)
+                yield fp.read(length)
+
+    def close(self) -> None:
+        self._connection.close()
+
+def findXMLRecordTag(filePath: Path, encoding: str = "utf-8") -> str:
+    with zp.openStream(filePath, binary=True) as stream:
+        depth = 0
+        for _, element in etree.iterparse(stream, events=("start",), encoding=encoding, huge_tree=True):
+            if depth == 1: # First child of the root is the record tag
+                return element.tag
+
+            depth += 1
+
+    return ""
@@ -0,0 +1,95 @@
+import sqlite3
+import pandas as pd
+import pyarrow as pa
+from pathlib import Path
+from lib.tools.logger import Logger
+
+class RecordStore:
+    _queryLimit = 500 # Keys per IN query, staying under sqlite variable limit
+
+    def __init__(self, dbPath: Path, keyColumn: str = ""):
+        dbPath.parent.mkdir(parents=True, exist_ok=True)
+
+        self.dbPath = dbPath
+        self._connection = sqlite3.connect(dbPath)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._connection.commit()
+
+        storedKey = self._getMeta("keyColumn")
+        if keyColumn and storedKey and keyColumn != storedKey:
+            raise Exception(f"Store {dbPath.name} is keyed on '{storedKey}', not '{keyColumn}'") from AttributeError
+
+        self.keyColumn = keyColumn or storedKey
+        if not self.keyColumn:
+            raise Exception(f"No key column provided for new store {dbPath.name}") from AttributeError
+
+        self.columns = [row[1] for row in self._connection.execute("PRAGMA table_info(records)")]
+
+    def _getMeta(self, key: str) -> str | None:
+        row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    @staticmethod
+    def _quote(column: str) -> str:
+        return '"' + column.replace('"', '""') + '"'
+
+    def clear(self) -> None:
+        with self._connection:
+            self._connection.execute("DROP TABLE IF EXISTS records")
+            self._connection.execute("INSERT OR REPLACE INTO meta VALUES ('keyColumn', ?)", (self.keyColumn,))
+
+        self.columns = []
+
+    def load(self, data: pd.DataFrame | pa.Table) -> None:
+        if isinstance(data, pa.Table):
+            data = data.to_pandas()
+
+        if self.keyColumn not in data.columns:
+            Logger.warning(f"Key column '{self.keyColumn}' missing from data, skipping {len(data)} rows")
+            return
+
+        # Key first so the index covers it, later batches may bring new columns
+        newColumns = [column for column in dict.fromkeys([self.keyColumn] + list(data.columns)) if column not in self.columns]
+        with self._connection:
+            if not self.columns:
+                self._connection.execute(f"CREATE TABLE records ({', '.join(f'{self._quote(column)} TEXT' for column in newColumns)})")
+                self._connection.execute("INSERT OR REPLACE INTO meta VALUES ('keyColumn', ?)", (self.keyColumn,))
+            else:
+                for column in newColumns:
+                    self._connection.execute(f"ALTER TABLE records ADD COLUMN {self._quote(column)} TEXT")
+
+            self.columns.extend(newColumns)
+
+            columns = list(data.columns)
+            data = data.astype(object).where(data.notna(), None)
+            self._connection.executemany(
+                f"INSERT INTO records ({', '.join(self._quote(column) for column in columns)}) VALUES ({', '.join('?' * len(columns))})",
+                data.itertuples(index=False, name=None)
+            )
+
+    def finalise(self) -> None:
+        if not self.columns:
+            return
+
+        with self._connection: # Built once after loading, far cheaper than maintaining it through every insert
+            self._connection.execute(f"CREATE INDEX IF NOT EXISTS recordKeys ON records ({self._quote(self.keyColumn)})")
+
+        self._connection.execute("PRAGMA optimize")
+
+    def lookup(self, keys: list[str]) -> pd.DataFrame:
+        if not self.columns:
+            return pd.DataFrame()
+
+        frames = []
+        keys = list(dict.fromkeys(keys))
+        for start in range(0, len(keys), self._queryLimit):
+            section = keys[start:start + self._queryLimit]
+            query = f"SELECT * FROM records WHERE {self._quote(self.keyColumn)} IN ({','.join('?' * len(section))})"
+            frames.append(pd.DataFrame(self._connection.execute(query, section).fetchall(), columns=self.columns))
+
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=self.columns)
+
+    def close(self) -> None:
+        self._connection.close()
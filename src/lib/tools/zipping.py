@@ -1,8 +1,101 @@
 import zipfile
+import tarfile
 import shutil
+import gzip
+import bz2
+import lzma
+import io
+import queue
+import threading
 from pathlib import Path
+from typing import IO
 from lib.tools.logger import Logger
-        
+
+class _ThreadedReader(io.RawIOBase):
+    def __init__(self, fileObj: IO[bytes], chunkSize: int = 1024*1024, bufferedChunks: int = 8):
+        self._fileObj = fileObj
+        self._chunkSize = chunkSize
+        self._queue = queue.Queue(bufferedChunks)
+        self._stopped = threading.Event()
+
+        self._view = memoryview(b"")
+        self._pos = 0
+        self._eof = False
+
+        # Decompressors release the GIL, so reading ahead in a thread overlaps decompression with parsing
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def _put(self, item: bytes | Exception) -> None:
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _fill(self) -> None:
+        try:
+            while not self._stopped.is_set():
+                chunk = self._fileObj.read(self._chunkSize)
+                self._put(chunk)
+                if not chunk:
+                    return
+        except Exception as e:
+            self._put(e)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: memoryview) -> int:
+        if self._pos >= len(self._view):
+            if self._eof:
+                return 0
+
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                raise item
+
+            if not item:
+                self._eof = True
+                return 0
+
+            self._view = memoryview(item)
+            self._pos = 0
+
+        size = min(len(buffer), len(self._view) - self._pos)
+        buffer[:size] = self._view[self._pos:self._pos + size]
+        self._pos += size
+        return size
+
+    def close(self) -> None:
+        if self.closed:
+            return
+
+        self._stopped.set()
+        self._thread.join()
+        self._fileObj.close()
+        super().close()
+
+class _ArchiveMember(io.RawIOBase):
+    def __init__(self, member: IO[bytes], archive: tarfile.TarFile):
+        self._member = member
+        self._archive = archive # Member reads through the archive's file handle, so both close together
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: memoryview) -> int:
+        return self._member.readinto(buffer)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+
+        self._member.close()
+        self._archive.close()
+        super().close()
+
 class RepeatExtractor:
     def __init__(self, outputDir: str = "", addSuffix: str = "", overwrite: bool = False):
         self.outputDir = outputDir
@@ -54,6 +147,69 @@ def compress(filePath: Path, outputDir: Path = None, zipName: str = None) -> Pat
     
     return outputFile
 
+def listMembers(filePath: Path) -> list[str]:
+    if zipfile.is_zipfile(filePath):
+        with zipfile.ZipFile(filePath) as archive:
+            return [info.filename for info in archive.infolist() if not info.is_dir()]
+
+    if ".tar" in filePath.suffixes or filePath.suffix == ".tgz":
+        with tarfile.open(filePath) as archive:
+            return [info.name for info in archive.getmembers() if info.isfile()]
+
+    return []
+
+def openStream(filePath: Path, member: str = None, binary: bool = False, encoding: str = "utf-8", threaded: bool = True) -> IO:
+    suffix = filePath.suffix.lower()
+
+    if member is not None or suffix in (".zip", ".tar", ".tgz") or ".tar" in filePath.suffixes:
+        members = listMembers(filePath)
+        if member is None:
+            if len(members) != 1:
+                raise Exception(f"Archive {filePath} has {len(members)} members, a member must be specified") from AttributeError
+            member = members[0]
+
+        if zipfile.is_zipfile(filePath):
+            with zipfile.ZipFile(filePath) as archive: # Member keeps underlying file open after archive closes
+                stream = archive.open(member)
+        else:
+            archive = tarfile.open(filePath)
+            stream = io.BufferedReader(_ArchiveMember(archive.extractfile(member), archive))
+
+    elif suffix == ".gz":
+        stream = gzip.open(filePath, "rb")
+    elif suffix == ".bz2":
+        stream = bz2.open(filePath, "rb")
+    elif suffix == ".xz":
+        stream = lzma.open(filePath, "rb")
+    else:
+        stream = open(filePath, "rb")
+        threaded = False # Nothing to decompress
+
+    if threaded:
+        stream = io.BufferedReader(_ThreadedReader(stream))
+
+    if binary:
+        return stream
+    
+    return io.TextIOWrapper(stream, encoding=encoding)
+
+def decompressedCopy(filePath: Path) -> Path:
+    name = filePath.name
+    while Path(name).suffix.lower() in (".gz", ".bz2", ".xz"):
+        name = Path(name).stem
+
+    copyPath = filePath.parent / f".{name}.raw" # Hidden with its own suffix so globs over the folder don't pick it up
+    if copyPath.exists() and copyPath.stat().st_mtime >= filePath.stat().st_mtime: # Kept between runs while the source is unchanged
+        return copyPath
+
+    Logger.info(f"Decompressing {filePath.name} to {copyPath.name}")
+    partialPath = copyPath.with_name(f"{copyPath.name}.part")
+    with openStream(filePath, binary=True) as stream, open(partialPath, "wb") as fp:
+        shutil.copyfileobj(stream, fp, 16 * 1024 * 1024)
+
+    partialPath.replace(copyPath)
+    return copyPath
+
 def canBeExtracted(filePath: Path) -> bool:
     return any(suffix in (".zip", ".tar", ".gz", ".xz", ".bz2") for suffix in filePath.suffixes)
 
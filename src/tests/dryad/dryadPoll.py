@@ -4,7 +4,7 @@ import datetime
 import time
 import json
 from pathlib import Path
-import requests
+import lib.tools.httpClient as hc
 from urllib.parse import urljoin
 import logging
 import traceback
@@ -63,10 +63,11 @@ class DataEntry:
 
 class DryadRequest:
     serverCall = "https://datadryad.org/api/v2/datasets"
+    session = hc.CachedSession("dryad", ttl=0) # Always poll for new datasets, responses are only recorded for replay
 
     def __init__(self, pageNumber=1):
         call = urljoin(self.serverCall, f"?page={pageNumber}")
-        response = requests.get(call)
+        response = self.session.get(call)
         raw = response.json()
 
         self.page = pageNumber
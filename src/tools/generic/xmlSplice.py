@@ -1,39 +1,35 @@
 import argparse
 from pathlib import Path
-from xml.etree import cElementTree as etree
-
-def getelements(filename_or_file):
-    context = iter(etree.iterparse(filename_or_file, events=('start', 'end')))
-    _, root = next(context) # get root element
-
-    event, element = next(context)
-    tag = element.tag
-
-    topLevelTag = tag
-
-    while tag is not root.tag:
-        if event == 'end' and element.tag == topLevelTag:
-            yield element
-            root.clear()
-
-        event, element = next(context)
-        tag = element.tag
+from lib.tools.recordIndex import RecordIndex
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Get splices from an xml")
     parser.add_argument('filepath', help="Path to input file")
     parser.add_argument('-f', '--firstEntry', type=int, default=0, help="First entry to grab entries from")
     parser.add_argument('-e', '--entries', type=int, default=1, help="Amount of entries to grab")
+    parser.add_argument('-k', '--keys', default="", help="Comma separated record keys to grab instead of an entry range, such as biosample accessions")
+    parser.add_argument('-t', '--tag', default="", help="Record tag, defaults to the first child of the root element")
+    parser.add_argument('-a', '--keyAttribute', default="accession", help="Record attribute used as the key")
     args = parser.parse_args()
 
     path = Path(args.filepath)
     outputDir = path.parent
 
-    with open(outputDir / "xmlSplice.xml", 'wb') as fp:
-        for idx, page in enumerate(getelements(path)):
-            if idx >= args.firstEntry:
-                fp.write(etree.tostring(page, encoding='utf-8'))
+    index = RecordIndex.forXML(path, args.tag, args.keyAttribute) # Built once and reused while the file is unchanged
+    if args.keys:
+        keys = [key.strip() for key in args.keys.split(",") if key.strip()]
+        found = index.lookup(keys)
+
+        missing = [key for key in keys if key not in found]
+        if missing:
+            print(f"No records found for keys: {', '.join(missing)}")
 
-            if idx >= (args.firstEntry + (args.entries - 1)):
-                break
+        locations = [found[key] for key in keys if key in found]
+    else:
+        locations = index.getRange(args.firstEntry, args.entries)
+
+    with open(outputDir / "xmlSplice.xml", 'wb') as fp:
+        for record in index.read(locations):
+            fp.write(record)
 
+    index.close()
@@ -1,153 +1,328 @@
 import argparse
 import json
+import re
 from pathlib import Path
-from xml.etree import cElementTree as ET
-from lib.tools.subfileWriter import Writer
-import lib.commonFuncs as cmn
-import gc
-import pandas as pd
-
-class ElementContainer:
-    def __init__(self, element: ET.Element):
-        self.element = element
-        self.tag = element.tag
-        self.children = {}
-
-        self.text = self.cleanText(element.text) if element.text else ""
-        self.attributes = element.attrib.copy()
-
-    def cleanText(self, text: str) -> str:
-        if text is None:
-            return
+from typing import Iterator
+from lxml import etree
+from lib.tools.bigFileWriter import BigFileWriter
+from lib.tools.logger import Logger
+from lib.tools.recordIndex import RecordIndex
+from lib.tools.recordStore import RecordStore
+import lib.tools.recordIndex as ri
+import lib.tools.zipping as zp
+import pyarrow as pa
+import pyarrow.parquet as pq
+import concurrent.futures
+import io
+import os
+
+class ExtractionRules:
+    def __init__(self, onlyIncludeTags: list = [], compressChild: list = [], collectionExtract: dict = {}):
+        self.onlyIncludeTags = frozenset(onlyIncludeTags)
+        self.compressChild = frozenset(compressChild)
+
+        # Flattened to (attribute, {attribute value: new column}) pairs per tag so records only need dict lookups
+        self.collectionExtract = {tag: list(splitAttrib.items()) for tag, splitAttrib in collectionExtract.items()}
+
+    def includes(self, tag: str) -> bool:
+        return not self.onlyIncludeTags or tag in self.onlyIncludeTags
+
+    def flatten(self, element: etree._Element, extract: bool = True) -> dict:
+        flat = {}
+        tag = element.tag
 
-        for c in ("\n", "\r", "\t"): # Characters to remove
-            text = text.replace(c, "")
-
-        for x in ("B", "I", "P", "b", "i", "p"): # XML tags to remove
-            text = text.replace(f"<{x}>", "").replace(f"</{x}>", "")
-        
-        return text.strip()
-    
-    def addChild(self, element: 'ElementContainer'):
-        if element.tag not in self.children:
-            self.children[element.tag] = [element]
-            return
-        
-        self.children[element.tag].append(element)
+        text = _cleanText(element.text)
+        if text:
+            flat[f"{tag}_text"] = text
 
-    def extractAttributes(self, splitAttrib: dict, delete: bool = False) -> dict:
-        extracted = {}
+        for attr, value in element.attrib.items():
+            flat[f"{tag}_{attr}"] = value
 
-        for attribute, valueMap in splitAttrib.items():
-            for attributeValue, newColumn in valueMap.items():
-                if self.attributes.get(attribute, None) == attributeValue:
-                    if delete: # Remove old attribute
-                        self.attributes.pop(attribute) 
+        children: dict[str, list[etree._Element]] = {}
+        for child in element:
+            if not isinstance(child.tag, str) or not self.includes(child.tag): # Skip comments and excluded tags
+                continue
 
-                    extracted |= {newColumn: self.text}
-                    break
+            children.setdefault(child.tag, []).append(child)
+
+        for childTag, childElements in children.items():
+            if len(childElements) > 1 or childTag in self.compressChild:
+                if extract and childTag in self.collectionExtract:
+                    for child in childElements:
+                        flat |= self._extractAttributes(child, self.collectionExtract[childTag])
+
+                flat[tag] = [self.flatten(child, False) for child in childElements]
+
+            else:
+                flat |= self.flatten(childElements[0], extract)
+
+        return flat
+
+    def _extractAttributes(self, element: etree._Element, splitAttrib: list[tuple[str, dict]]) -> dict:
+        extracted = {}
+
+        for attribute, valueMap in splitAttrib:
+            newColumn = valueMap.get(element.get(attribute))
+            if newColumn is not None:
+                extracted[newColumn] = _cleanText(element.text)
 
         return extracted
 
-    def flatten(self, compressChildren: list = [], collectionExtract: dict = {}) -> dict:
-        flat = {}
+class _ShardReader(io.RawIOBase):
+    def __init__(self, filePath: Path, start: int, end: int, header: bytes, footer: bytes):
+        self._parts = [io.BytesIO(header), None, io.BytesIO(footer)]
+        self._filePath = filePath
+        self._start = start
+        self._remaining = end - start
 
-        if self.text:
-            flat[f"{self.tag}_text"] = self.text
+    def readable(self) -> bool:
+        return True
 
-        for attr, value in self.attributes.items():
-            flat[f"{self.tag}_{attr}"] = value
+    def readinto(self, buffer: memoryview) -> int:
+        while self._parts:
+            part = self._parts[0]
+            if part is None: # Opened lazily so shards can be built without holding file handles
+                part = self._parts[0] = open(self._filePath, "rb")
+                part.seek(self._start)
 
-        for tag, children in self.children.items():
-            if len(children) > 1 or tag in compressChildren:
-                if tag in collectionExtract:
-                    for child in children:
-                        flat |= child.extractAttributes(collectionExtract[tag])
+            size = len(buffer)
+            if not isinstance(part, io.BytesIO):
+                size = min(size, self._remaining)
 
-                flat |= {self.tag: [child.flatten(compressChildren) for child in children]}
-                
-            else:
-                flat |= children[0].flatten(compressChildren, collectionExtract)
+            read = part.readinto(buffer[:size]) if size > 0 else 0
+            if read:
+                if not isinstance(part, io.BytesIO):
+                    self._remaining -= read
 
-        return flat
+                return read
+
+            part.close()
+            self._parts.pop(0)
+
+        return 0
+
+    def close(self) -> None:
+        for part in self._parts:
+            if part is not None:
+                part.close()
+
+        self._parts.clear()
+        super().close()
+
+_removeChars = str.maketrans("", "", "\n\r\t")
+_removeTags = re.compile(r"</?[BIPbip]>")
+
+def _cleanText(text: str | None) -> str:
+    if not text:
+        return ""
+
+    text = text.translate(_removeChars)
+    if "<" in text: # XML tags to remove
+        text = _removeTags.sub("", text)
+
+    return text.strip()
+
+def iterRecords(stream, recordTag: str, rules: ExtractionRules, encoding: str = "utf-8") -> Iterator[dict]:
+    for _, element in etree.iterparse(stream, events=("end",), tag=recordTag, encoding=encoding, huge_tree=True, remove_comments=True):
+        parent = element.getparent()
+        if parent is None or parent.getparent() is not None: # Nested element sharing the record tag
+            continue
+
+        yield rules.flatten(element)
+
+        # Free parsed records, keeping memory flat for the whole file
+        element.clear()
+        while element.getprevious() is not None:
+            del parent[0]
+
+def findShards(filePath: Path, recordTag: str, shardCount: int, chunkSize: int = 1024*1024) -> tuple[bytes, bytes, list[tuple[int, int]]]:
+    localTag = recordTag.rsplit("}", 1)[-1] # Namespaced tags are written with an optional prefix in the file
+    recordStart = re.compile(rb"<(?:[\w.-]+:)?" + re.escape(localTag.encode()) + rb"[\s/>]")
+    fileSize = filePath.stat().st_size
+
+    def nextRecord(fp: io.BufferedReader, position: int) -> int:
+        fp.seek(position)
+        overlap = b""
+        while chunk := fp.read(chunkSize):
+            match = recordStart.search(overlap + chunk)
+            if match is not None:
+                return position - len(overlap) + match.start()
+
+            position += len(chunk)
+            overlap = chunk[-len(localTag) - 64:] # Keeps tags split across chunks findable
+
+        return -1
+
+    with open(filePath, "rb") as fp:
+        firstRecord = nextRecord(fp, 0)
+        if firstRecord < 0:
+            return b"", b"", []
+
+        fp.seek(max(0, fileSize - chunkSize))
+        tail = fp.read()
+        footerStart = fileSize - len(tail) + tail.rfind(b"</") # Closing root tag ends the final shard
 
-def process(filePath: Path, outputFilePath: Path, encoding="utf-8", entryCount: int = 0, firstEntry: int = 0, subfileRows: int = 0, onlyIncludeTags: list = [], compressChild: list = [], collectionExtract: dict = {}):
-    writer = Writer(outputFilePath.parent, "xmlProcessing", "xmlSection")
+        fp.seek(0)
+        header = fp.read(firstRecord) # Declaration, doctype and root tag with its namespaces
+        footer = tail[tail.rfind(b"</"):]
 
+        boundaries = [firstRecord]
+        for shard in range(1, shardCount):
+            target = firstRecord + (footerStart - firstRecord) * shard // shardCount
+            if target <= boundaries[-1]:
+                continue
+
+            boundary = nextRecord(fp, target)
+            if boundary < 0 or boundary >= footerStart:
+                break
+
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+
+    return header, footer, list(zip(boundaries, boundaries[1:] + [footerStart]))
+
+def parseShard(filePath: Path, start: int, end: int, header: bytes, footer: bytes, recordTag: str, rules: ExtractionRules, encoding: str, subfileDir: Path, shardName: str, batchSize: int) -> list[Path]:
+    subfileDir.mkdir(parents=True, exist_ok=True)
+
+    writtenFiles = []
+    def writeBatch(records: list[dict]) -> None:
+        subfilePath = subfileDir / f"{shardName}_{len(writtenFiles)}.parquet"
+        pq.write_table(buildTable(records), subfilePath)
+        writtenFiles.append(subfilePath)
+
+    records = []
+    with io.BufferedReader(_ShardReader(filePath, start, end, header, footer)) as stream: # Shard is wrapped in the original root so it parses as a document
+        for record in iterRecords(stream, recordTag, rules, encoding):
+            records.append(record)
+            if len(records) >= batchSize:
+                writeBatch(records)
+                records.clear()
+
+    if records:
+        writeBatch(records)
+
+    return writtenFiles
+
+def buildTable(records: list[dict]) -> pa.Table:
+    columns = list(dict.fromkeys(key for record in records for key in record))
+
+    arrays = []
+    for column in columns:
+        values = [record.get(column) for record in records]
+        arrays.append(pa.array([value if value is None or isinstance(value, str) else str(value) for value in values], pa.string())) # Compressed collections are stored as their text representation
+
+    return pa.Table.from_arrays(arrays, names=columns)
+
+def process(filePath: Path, outputFilePath: Path, encoding="utf-8", entryCount: int = 0, firstEntry: int = 0, subfileRows: int = 0, onlyIncludeTags: list = [], compressChild: list = [], collectionExtract: dict = {}, recordTag: str = "", workers: int = None, minShardSize: int = 64*1024*1024, indexKey: str = "accession", storeKey: str = "", decompress: bool = False):
     if entryCount < 0:
         raise Exception(f"Invalid entry count {entryCount}, must be >= 0") from AttributeError
 
     if firstEntry < 0:
         raise Exception(f"Invalid first entry {firstEntry}, must be >= 0") from AttributeError
-    
+
     if subfileRows < 0:
         raise Exception(f"Invalid subfile rows {subfileRows}, must be >= 0") from AttributeError
 
-    lastEntry = (firstEntry + entryCount - 1) if entryCount > 0 else -1 # Ignore last entry if all entries requested
+    if not recordTag:
+        recordTag = ri.findXMLRecordTag(filePath, encoding)
+
+    if not recordTag:
+        Logger.warning(f"No records found in file {filePath}")
+        return
+
+    rules = ExtractionRules(onlyIncludeTags, compressChild, collectionExtract)
+    if not rules.includes(recordTag):
+        Logger.warning(f"Record tag '{recordTag}' is not in included tags, no records to write")
+        return
 
-    parser = ET.XMLParser(encoding=encoding)
-    iterator = ET.iterparse(filePath, events=('start', 'end'), parser=parser)
-    _, root = next(iterator)
+    writer = BigFileWriter(outputFilePath, "xmlProcessing", "xmlSection")
+    batchSize = subfileRows if subfileRows > 0 else 100000
 
-    event, element = next(iterator)
-    topLevelTag = element.tag
+    if workers is None:
+        workers = os.cpu_count() or 1
 
-    path = [ElementContainer(element)]
-    data = []
-    columns = []
-    currentEntry = 0
+    # Shards and index seeks need byte offsets into the raw file, compressed files are streamed serially unless a kept decompressed copy is allowed
+    seekable = decompress or not zp.canBeExtracted(filePath)
 
-    print(f'At entry: {currentEntry+1:,}', end='\r')
-    for event, element in iterator:
-        if event == 'start':
-            path.append(ElementContainer(element))
+    # Entry ranges seek straight to their records through the file's sidecar index
+    if (entryCount or firstEntry) and seekable:
+        index = RecordIndex.forXML(filePath, recordTag, indexKey)
+        span = index.getSpan(firstEntry, entryCount)
+        if span is not None:
+            for subfilePath in parseShard(index.filePath, *span, index.header, index.footer, recordTag, rules, encoding, writer.subfileDir, writer.sectionPrefix, batchSize):
+                writer.addSubfile(subfilePath)
 
-            if element.tag == topLevelTag and len(path) == 1:
-                currentEntry += 1
-                print(f'At entry: {currentEntry+1:,}', end='\r')
+        index.close()
+        _finalise(writer, storeKey)
+        return
 
-        elif event == 'end':
-            if element == root:
+    if seekable and zp.canBeExtracted(filePath):
+        filePath = zp.decompressedCopy(filePath)
+
+    _parse(filePath, writer, recordTag, rules, encoding, batchSize, workers, minShardSize, firstEntry, entryCount)
+    _finalise(writer, storeKey)
+
+def _parse(filePath: Path, writer: BigFileWriter, recordTag: str, rules: ExtractionRules, encoding: str, batchSize: int, workers: int, minShardSize: int, firstEntry: int, entryCount: int) -> None:
+    if workers > 1 and not zp.canBeExtracted(filePath):
+        shardCount = min(workers, filePath.stat().st_size // minShardSize)
+        if shardCount > 1:
+            _processShards(filePath, writer, recordTag, rules, encoding, batchSize, workers, shardCount)
+            return
+
+    lastEntry = (firstEntry + entryCount) if entryCount > 0 else -1
+
+    records = []
+    with zp.openStream(filePath, binary=True) as stream: # Compressed files are decompressed while parsing
+        for idx, record in enumerate(iterRecords(stream, recordTag, rules, encoding)):
+            if idx == lastEntry:
                 break
 
-            elementContainer = path.pop()
+            if idx % 10000 == 0:
+                print(f"At entry: {idx+1:,}", end="\r")
 
-            if onlyIncludeTags and element.tag not in onlyIncludeTags:
-                element.clear()
-                root.clear()
+            if idx < firstEntry:
                 continue
 
-            # Data writing only happens at end of top level tag
-            if element.tag != topLevelTag or len(path) > 1: # Make sure path length 1 incase sub element has same name
-                path[-1].addChild(elementContainer)
-                element.clear()
-                continue
+            records.append(record)
+            if len(records) >= batchSize:
+                writer.writeTable(buildTable(records))
+                records.clear()
+
+    # Write remaining data to file
+    if records:
+        writer.writeTable(buildTable(records))
 
-            if len(data) >= firstEntry: # Only add data if it is within data entry range
-                flatContainer = elementContainer.flatten(compressChild, collectionExtract)
-                data.append(flatContainer)
-                columns = cmn.extendUnique(columns, flatContainer.keys())
-                if len(data) == lastEntry: # Exit if last entry reached
-                    break
+    print()
 
-            if len(data) == subfileRows:
-                df = pd.DataFrame.from_records(data, columns=columns)
-                writer.writeDF(df)
-                data.clear()
-                columns.clear()
-                del df
-                gc.collect()
+def _processShards(filePath: Path, writer: BigFileWriter, recordTag: str, rules: ExtractionRules, encoding: str, batchSize: int, workers: int, shardCount: int) -> None:
+    header, footer, shards = findShards(filePath, recordTag, shardCount)
+    Logger.info(f"Parsing {filePath.name} as {len(shards)} shards with {workers} workers")
 
-            element.clear()
-            root.clear()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(parseShard, filePath, start, end, header, footer, recordTag, rules, encoding, writer.subfileDir, f"{writer.sectionPrefix}_{idx}", batchSize) for idx, (start, end) in enumerate(shards)]
 
-    # Write remaining data to file
-    if data:
-        df = pd.DataFrame.from_records(data, columns=columns)
-        writer.writeDF(df)
+        for idx, future in enumerate(futures, start=1): # Collected in shard order so output keeps file order
+            for subfilePath in future.result():
+                writer.addSubfile(subfilePath)
+
+            print(f"Parsed shard: {idx}/{len(futures)}", end="\r")
 
     print()
-    writer.oneFile(outputFilePath) # Compress to one file
+
+def _finalise(writer: BigFileWriter, storeKey: str) -> None:
+    if storeKey: # Keyed store is loaded from the subfiles before they're combined, avoiding another pass over the output
+        store = RecordStore(writer.outputFile.with_suffix(".sqlite"), storeKey)
+        store.clear()
+
+        for subfile in writer.writtenFiles:
+            for chunk in subfile.readChunks(100000):
+                store.load(chunk)
+
+        store.finalise()
+        store.close()
+        Logger.info(f"Loaded records into store {store.dbPath}")
+
+    writer.oneFile() # Compress to one file
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Convert xml to csv")
@@ -166,16 +341,18 @@ if __name__ == '__main__':
 
     outputPath = Path(args.outputFilePath)
 
-    tagProperties = Path(args.tagProperties)
-    if not tagProperties.exists():
-        print(f"No tagfile found at path: {tagProperties}")
-        exit()
+    properties = {}
+    if args.tagProperties:
+        tagProperties = Path(args.tagProperties)
+        if not tagProperties.exists():
+            print(f"No tagfile found at path: {tagProperties}")
+            exit()
 
-    with open(args.tagProperties) as fp:
-        properties = json.load(fp)
+        with open(tagProperties) as fp:
+            properties = json.load(fp)
 
     onlyIncludeTags = properties.get("onlyIncludeTags", [])
     compressChild = properties.get("compressChild", [])
     collectionExtract = properties.get("collectionExtract", {})
 
-    process(inputPath, outputPath, args.entries, args.firstEntry, args.subfile, onlyIncludeTags, compressChild, collectionExtract)
+    process(inputPath, outputPath, entryCount=args.entries, firstEntry=args.firstEntry, subfileRows=args.subfile, onlyIncludeTags=onlyIncludeTags, compressChild=compressChild, collectionExtract=collectionExtract)
@@ -3,6 +3,8 @@ from lib.processing.stages import Step
 
 if __name__ == '__main__':
     parser = ArgParser(description="Download source data")
+    parser.add_argument("-w", "--workers", type=int, help="Amount of files to download concurrently, overrides source config")
+    parser.add_argument("-l", "--hostLimit", type=int, help="Maximum concurrent connections to a single host, overrides source config")
 
     sources, overwrite, verbose, args = parser.parse_args()
     kwargs = parser.namespaceKwargs(args)